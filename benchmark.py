@@ -0,0 +1,232 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime
+
+import duckdb
+
+import config
+import data_analyzer
+import duck_data_proc
+import generate_data
+import results_store
+import schema
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def timed(results, stage, name, fn, *args, **kwargs):
+    """Call fn, append its wall time to results and return its value."""
+    start = time.perf_counter()
+    value = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    results.append({'stage': stage, 'name': name, 'seconds': round(seconds, 4)})
+    logging.info(f"{stage:<10} {name:<45} {seconds:8.3f}s")
+    return value
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(csv_path, workdir, ingest_mode='table', small_data_csv='Small_data.csv', settings=None):
+    """
+    Time every pipeline stage against csv_path, using databases inside workdir:
+    ingest, the cube and each report, SQLite export, and the reads the
+    dashboard makes, with the DuckDB settings of `settings` (see config.py).
+    Returns the row count and a list of {stage, name, seconds} results.
+    """
+    settings = settings or config.load_config()
+    results = []
+    duckdb_path = os.path.join(workdir, 'file_db.duckdb')
+    sqlite_path = os.path.join(workdir, 'sqlite_file.sqlite')
+
+    with duckdb.connect(duckdb_path) as conn:
+        config.apply_duckdb_settings(conn, settings)
+
+        # Ingest
+        if ingest_mode == 'lake':
+            timed(results, 'ingest', 'lake', duck_data_proc.load_data_into_parquet_lake,
+                  conn, csv_path, os.path.join(workdir, 'divvy_lake'))
+        elif ingest_mode == 'incremental':
+            timed(results, 'ingest', 'incremental', duck_data_proc.load_data_incrementally, conn, csv_path)
+        else:
+            timed(results, 'ingest', 'table', duck_data_proc.load_data_into_duckdb, conn, csv_path)
+        rows = conn.execute("SELECT COUNT(*) FROM divvy_data").fetchone()[0]
+
+        # Analysis: the star schema when the cube reads from it, the shared cube scan, then every report
+        cube_source = settings['cube_source']
+        if cube_source == 'star':
+            timed(results, 'analysis', 'star_schema', schema.refresh_star_schema, conn)
+        timed(results, 'analysis', 'divvy_cube', data_analyzer.build_cube, conn, cube_source)
+        for name, query in data_analyzer.queries.items():
+            timed(results, 'analysis', name, data_analyzer.compute_report, conn, name, query)
+
+        # Export
+        conn.execute("LOAD sqlite;")
+        conn.execute(f"ATTACH '{sqlite_path}' AS sqlite_db (TYPE SQLITE);")
+        cursor = conn.cursor()
+        for name in data_analyzer.queries:
+            timed(results, 'export', name, data_analyzer.export_report, cursor, name)
+        cursor.close()
+        conn.execute("DETACH sqlite_db;")
+
+    if small_data_csv and os.path.exists(small_data_csv):
+        timed(results, 'export', 'small_data', data_analyzer.load_csv_to_sqlite, small_data_csv,
+              sqlite_path, 'small_data', index_columns=data_analyzer.SMALL_DATA_INDEXES)
+
+    # The reads behind each dashboard section
+    with closing(sqlite3.connect(sqlite_path)) as conn:
+        growth = "The_growth_rate_of_cyclists_results"
+        low, high = timed(results, 'dashboard', 'growth_year_range', results_store.column_range,
+                          conn, growth, 'st_year')
+        timed(results, 'dashboard', 'growth_page', results_store.fetch_page, conn, growth,
+              filters={'st_year': (low, high)}, order_by='st_year')
+        timed(results, 'dashboard', 'gender_page', results_store.fetch_page,
+              conn, "Travel_duration_according_gender_results")
+        timed(results, 'dashboard', 'top10_stations', results_store.top_n,
+              conn, "Popular_Stations_results", 'total_rides', 10)
+        timed(results, 'dashboard', 'age_groups', results_store.fetch_page,
+              conn, "What_are_the_Age_target_of_the_company_results",
+              filters={'age_group': ['Under 25', '25-35', '36-50', 'Over 50']})
+        timed(results, 'dashboard', 'temporal_page', results_store.fetch_page,
+              conn, "The_Month_and_the_day_of_trips_results", order_by='period_type')
+        if results_store.table_columns(conn, 'small_data'):
+            timed(results, 'dashboard', 'small_data_first_page', results_store.fetch_keyset_page,
+                  conn, 'small_data', page_size=100)
+            timed(results, 'dashboard', 'small_data_row_count', results_store.row_count, conn, 'small_data')
+
+    return rows, results
+
+
+# Renders one dashboard page with Streamlit's AppTest (no browser or server)
+# in a fresh interpreter, so every import the page triggers is cold, as in a
+# newly started dashboard container. Streamlit itself is left out of the
+# first paint: the server has imported it before any session connects.
+STARTUP_SCRIPT = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=300)
+app.session_state['page'] = sys.argv[2]
+app.run()
+painted = time.perf_counter()
+app.run()
+print(json.dumps({'first_paint': painted - start, 'rerun': time.perf_counter() - painted,
+                  'errors': [str(e.value) for e in app.exception]}))
+"""
+
+DASHBOARD_PAGES = ["Story", "Analytics", "Small Data", "Performance"]
+
+
+def measure_dashboard_startup(sqlite_path, pages=DASHBOARD_PAGES):
+    """
+    Time the first render of each dashboard page in a new process (cold
+    imports, empty caches) and a second render in the same process, reading
+    sqlite_path. Returns a list of {stage, name, seconds} results.
+    """
+    results = []
+    dashboard = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.py')
+    env = dict(os.environ, DIVVY_SQLITE_DB=os.path.abspath(sqlite_path))
+    for page in pages:
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, dashboard, page], env=env,
+                                capture_output=True, text=True, check=True).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        for error in timings['errors']:
+            logging.warning(f"Dashboard page {page} failed: {error}")
+        for measure in ('first_paint', 'rerun'):
+            seconds = timings[measure]
+            results.append({'stage': 'startup', 'name': f"{measure}:{page}", 'seconds': round(seconds, 4)})
+            logging.info(f"{'startup':<10} {measure + ':' + page:<45} {seconds:8.3f}s")
+    return results
+
+
+def compare(current, previous_path, threshold=1.2):
+    """Print each timing next to the same timing in an earlier results file."""
+    with open(previous_path) as f:
+        previous = {(r['stage'], r['name']): r['seconds'] for r in json.load(f)['results']}
+    print(f"\n{'stage':<10} {'name':<45} {'before':>9} {'after':>9} {'ratio':>7}")
+    for r in current:
+        before = previous.get((r['stage'], r['name']))
+        if before is None:
+            continue
+        ratio = r['seconds'] / before if before else float('inf')
+        flag = '  <-- slower' if ratio > threshold else ''
+        print(f"{r['stage']:<10} {r['name']:<45} {before:9.3f} {r['seconds']:9.3f} {ratio:7.2f}{flag}")
+
+
+# Main function
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingest, analysis, export and dashboard loads.")
+    parser.add_argument("--csv", default=None, help="existing trips CSV; generated when omitted")
+    parser.add_argument("--rows", default="1M", help="rows to generate when --csv is omitted (1M, 10M, 100M)")
+    parser.add_argument("--seed", type=int, default=42, help="seed for the generated data")
+    parser.add_argument("--ingest-mode", choices=["table", "lake", "incremental"], default="table")
+    parser.add_argument("--small-data-csv", default="Small_data.csv",
+                        help="CSV loaded into the small_data table")
+    parser.add_argument("--workdir", default=None, help="directory for the benchmark databases (default: temp)")
+    parser.add_argument("--output", default=None,
+                        help="results JSON (default: benchmark_results/benchmark_<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    parser.add_argument("--no-startup", action="store_true",
+                        help="skip timing the dashboard's first paint of each page")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+    settings = config.config_from_args(args)
+
+    started_at = datetime.now()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="divvy_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+
+    csv_path = args.csv
+    results = []
+    if csv_path is None:
+        csv_path = os.path.join(workdir, f"synthetic_{args.rows}.csv")
+        timed(results, 'generate', args.rows, generate_data.generate_csv, csv_path,
+              generate_data.parse_rows(args.rows), seed=args.seed)
+
+    total_start = time.perf_counter()
+    rows, stage_results = run_benchmark(csv_path, workdir, args.ingest_mode, args.small_data_csv, settings)
+    results += stage_results
+    if not args.no_startup:
+        results += measure_dashboard_startup(os.path.join(workdir, 'sqlite_file.sqlite'))
+
+    report = {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'csv': os.path.abspath(csv_path),
+        'rows': rows,
+        'seed': args.seed if args.csv is None else None,
+        'ingest_mode': args.ingest_mode,
+        'duckdb_settings': {key: settings[key] for key in config.DUCKDB_SETTINGS if settings[key]},
+        'profile': settings['profile'],
+        'cube_source': settings['cube_source'],
+        'python': platform.python_version(),
+        'duckdb': duckdb.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'total_seconds': round(time.perf_counter() - total_start, 4),
+        'results': results,
+    }
+    output = args.output or os.path.join(
+        "benchmark_results", f"benchmark_{started_at.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Benchmark of {rows:,} rows finished in {report['total_seconds']:.1f}s; results in {output}.")
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,138 @@
+import configparser
+import os
+
+# Settings shared by duck_data_proc.py, data_analyzer.py, benchmark.py and the
+# dashboard. Each one is looked up, in order of precedence, on the command
+# line, in a DIVVY_<NAME> environment variable, in divvy.ini (or the file
+# named by --config / DIVVY_CONFIG), in the chosen profile, and finally in
+# DEFAULTS below. An empty DuckDB setting leaves DuckDB's own default alone.
+CONFIG_FILE = "divvy.ini"
+
+DEFAULTS = {
+    'duckdb': {
+        'database': 'file_db.duckdb',
+        'memory_limit': '',
+        'threads': '',
+        'temp_directory': '',
+        'max_temp_directory_size': '',
+        'preserve_insertion_order': '',
+    },
+    'paths': {
+        'source_csv': '1 Full Divvy Dataframe final.csv',
+        'lake_dir': 'divvy_lake',
+        'sqlite_db': 'sqlite_file.sqlite',
+        'small_data_csv': 'Small_data.csv',
+        'od_flows': 'od_flows.npz',
+        'stream_feed': 'divvy_feed',
+    },
+    'pipeline': {
+        # 'star' builds the cube from schema.py's star schema, kept up to date at ingest;
+        # 'wide' scans divvy_data itself
+        'cube_source': 'star',
+    },
+    'dashboard': {
+        # Fill the Analytics caches in the background when the server starts
+        'prewarm': 'false',
+    },
+}
+
+# Named sets of DuckDB settings. out_of_core caps memory well below the size
+# of the data and lets large aggregations and sorts spill to temp_directory;
+# not preserving insertion order lets the CSV load and the exports stream
+# instead of buffering, and fewer threads means fewer hash tables in memory.
+PROFILES = {
+    'default': {},
+    'out_of_core': {
+        'memory_limit': '1GB',
+        'threads': '2',
+        'temp_directory': 'duckdb_spill',
+        'preserve_insertion_order': 'false',
+    },
+}
+
+DUCKDB_SETTINGS = ['memory_limit', 'threads', 'temp_directory', 'max_temp_directory_size',
+                   'preserve_insertion_order']
+
+
+def load_config(path=None, profile=None, overrides=None):
+    """
+    Return the effective settings as a flat dict, e.g. {'database': ...,
+    'memory_limit': ..., 'sqlite_db': ...}. `overrides` holds values from
+    the command line; None values are ignored.
+    """
+    config = {}
+    for section in DEFAULTS.values():
+        config.update(section)
+
+    path = path or os.environ.get('DIVVY_CONFIG', CONFIG_FILE)
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    from_file = {}
+    for section in DEFAULTS:
+        if parser.has_section(section):
+            from_file.update(parser[section])
+
+    profile = profile or os.environ.get('DIVVY_PROFILE') or from_file.get('profile', 'default')
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile '{profile}', expected one of {', '.join(PROFILES)}")
+    config.update(PROFILES[profile])
+    config['profile'] = profile
+
+    for key in list(config):
+        if key in from_file:
+            config[key] = from_file[key]
+        env = os.environ.get(f"DIVVY_{key.upper()}")
+        if env is not None:
+            config[key] = env
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            config[key] = str(value)
+    return config
+
+
+def add_config_arguments(parser):
+    """Add the shared --config, --profile and DuckDB setting options to an argparse parser."""
+    group = parser.add_argument_group("configuration")
+    group.add_argument("--config", default=None, help=f"INI file with settings (default: {CONFIG_FILE})")
+    group.add_argument("--profile", choices=list(PROFILES), default=None,
+                       help="named set of DuckDB settings; 'out_of_core' caps memory and spills to disk")
+    group.add_argument("--database", default=None, help="DuckDB database file")
+    group.add_argument("--sqlite-db", default=None, help="SQLite file the results are exported to")
+    group.add_argument("--cube-source", choices=["star", "wide"], default=None,
+                       help="build the analysis cube from the star schema or straight from divvy_data")
+    group.add_argument("--memory-limit", default=None, help="DuckDB memory_limit, e.g. 2GB")
+    group.add_argument("--threads", type=int, default=None, help="DuckDB worker threads")
+    group.add_argument("--temp-directory", default=None, help="directory DuckDB spills to")
+    group.add_argument("--max-temp-directory-size", default=None, help="cap on the spill directory, e.g. 50GB")
+    group.add_argument("--preserve-insertion-order", choices=["true", "false"], default=None,
+                       help="'false' lets DuckDB stream loads and exports in less memory")
+    return parser
+
+
+def config_from_args(args):
+    """Build the config from parsed arguments of a parser passed to add_config_arguments."""
+    overrides = {key: getattr(args, key) for key in
+                 ['database', 'sqlite_db', 'cube_source', 'memory_limit', 'threads', 'temp_directory',
+                  'max_temp_directory_size', 'preserve_insertion_order']}
+    return load_config(args.config, args.profile, overrides)
+
+
+def apply_duckdb_settings(conn, config):
+    """SET every DuckDB setting that has a value in config on an open connection."""
+    for key in DUCKDB_SETTINGS:
+        value = config.get(key, '')
+        if value == '':
+            continue
+        if key == 'temp_directory':
+            os.makedirs(value, exist_ok=True)
+        if key == 'threads':
+            value = int(value)
+        elif key == 'preserve_insertion_order':
+            value = str(value).lower() in ('1', 'true', 'yes', 'on')
+        conn.execute(f"SET {key} = ?", [value])
+
+
+def describe(config):
+    """One line summary of the DuckDB settings in effect, for logs."""
+    settings = ', '.join(f"{key}={config[key]}" for key in DUCKDB_SETTINGS if config.get(key))
+    return f"profile {config['profile']}" + (f" ({settings})" if settings else "")
@@ -1,7 +1,180 @@
+import io
+import json
+import threading
 import streamlit as st
 import sqlite3
-import pandas as pd
-import matplotlib.pyplot as plt
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+import config
+import results_store
+
+# pandas, matplotlib and the modules that pull in numpy or DuckDB (sketches,
+# rollups, live_queries) are imported inside the functions that use them:
+# they take over a second to load, and the text-only pages never need them.
+
+SETTINGS = config.load_config()
+DB_PATH = SETTINGS['sqlite_db']
+DUCKDB_PATH = SETTINGS['database']
+PREWARM = SETTINGS['prewarm'].lower() in ('1', 'true', 'yes', 'on')
+
+
+@st.cache_resource(show_spinner=False)
+def get_results_connection():
+    """Read-only connections to the results file, reused by every session."""
+    return results_store.ConnectionPool(DB_PATH)
+
+
+# Cached data layer. Every loader takes the data_version marker that
+# data_analyzer.py writes after each refresh as its first argument, so a new
+# refresh produces new cache keys and the old entries simply age out.
+def get_pipeline_meta(key):
+    """Return a marker from pipeline_meta ('' if the pipeline has not written it yet)."""
+    try:
+        with get_results_connection().connect() as conn:
+            row = conn.execute("SELECT value FROM pipeline_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else ''
+    except sqlite3.Error:
+        return ''
+
+
+def get_data_version():
+    """Return the current data_version marker ('' if the pipeline has not written one yet)."""
+    return get_pipeline_meta('data_version')
+
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def load_page(data_version, table_name, columns=None, filters=None, order_by=None,
+              descending=False, limit=None, offset=0):
+    with get_results_connection().connect() as conn:
+        return results_store.fetch_page(conn, table_name, columns=columns, filters=filters,
+                                        order_by=order_by, descending=descending,
+                                        limit=limit, offset=offset)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_latest(data_version, table_name, column, n):
+    with get_results_connection().connect() as conn:
+        return results_store.fetch_latest(conn, table_name, column, n)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_column_range(data_version, table_name, column):
+    with get_results_connection().connect() as conn:
+        return results_store.column_range(conn, table_name, column)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_distinct_values(data_version, table_name, column, filters=None):
+    with get_results_connection().connect() as conn:
+        return results_store.distinct_values(conn, table_name, column, filters)
+
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def load_keyset_page(data_version, table_name, columns, filters, sort_column, descending, after, page_size):
+    with get_results_connection().connect() as conn:
+        return results_store.fetch_keyset_page(conn, table_name, columns=columns, filters=filters,
+                                               sort_column=sort_column, descending=descending,
+                                               after=after, page_size=page_size)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_row_count(data_version, table_name, filters=None):
+    with get_results_connection().connect() as conn:
+        return results_store.row_count(conn, table_name, filters)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_column_types(data_version, table_name):
+    with get_results_connection().connect() as conn:
+        return results_store.column_types(conn, table_name)
+
+
+@st.cache_resource(show_spinner=False)
+def get_live_pool():
+    """
+    One live query pool for every session that turns live mode on. It holds no
+    connection, so pipeline runs can still write file_db.duckdb between queries.
+    """
+    import live_queries
+
+    return live_queries.LiveQueryPool(DUCKDB_PATH, settings=SETTINGS)
+
+
+GROWTH_TABLE = "the_growth_rate_of_cyclists_results"
+
+
+def load_growth_page(data_version, year_range):
+    """The growth-rate rows for a (first, last) year range, with st_year as text for the chart."""
+    df = load_page(data_version, GROWTH_TABLE, filters={'st_year': year_range}, order_by='st_year')
+    df['st_year'] = df['st_year'].astype(str)
+    return df
+
+
+# What the other Analytics sections load when first opened, as load_page
+# arguments and the chart (if any) drawn straight from the loaded page
+PREWARM_PAGES = [
+    ("Travel_duration_according_gender_results", {}, 'Travel_duration_according_gender'),
+    ("Popular_Stations_results", {'order_by': 'total_rides', 'descending': True, 'limit': 10}, 'Popular_Stations'),
+    ("the_Month_and_the_day_of_trips_results", {'order_by': 'period_type'}, 'the_Month_and_the_day_of_trips'),
+    ("station_centrality_results", {'order_by': 'pagerank_rank', 'limit': 10}, None),
+    ("hour_weekday_results", {}, 'hour_weekday'),
+]
+
+
+def prewarm(data_version):
+    """Import the plotting and dataframe libraries and fill the caches behind the Analytics sections."""
+    import matplotlib.pyplot  # noqa: F401
+    import pandas  # noqa: F401
+
+    # Growth Rate, the section Analytics opens on, starts on every year
+    try:
+        first, last = load_column_range(data_version, GROWTH_TABLE, 'st_year')
+        if first is not None:
+            render_png(load_growth_page(data_version, (int(first), int(last))), 'the_growth_rate_of_cyclists')
+    except (ValueError, sqlite3.Error):
+        pass  # not exported yet
+
+    for table, kwargs, chart in PREWARM_PAGES:
+        try:
+            page = load_page(data_version, table, **kwargs)
+        except (ValueError, sqlite3.Error):
+            continue  # not exported yet
+        if chart:
+            render_png(page, chart)
+
+
+@st.cache_resource(show_spinner=False)
+def start_prewarm():
+    """Run prewarm in the background, once per server process, while the first page renders."""
+    thread = threading.Thread(target=prewarm, args=(get_data_version(),), name='dashboard-prewarm', daemon=True)
+    add_script_run_ctx(thread)
+    thread.start()
+    return thread
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def render_png(result, name):
+    """
+    Rasterize a chart once per distinct (data, chart) pair; st.cache_data keys on
+    a hash of the DataFrame. The figure is closed straight away so pyplot does
+    not keep it alive.
+    """
+    import matplotlib.pyplot as plt
+
+    fig = create_visualizations(result.copy(), name)
+    if fig is None:
+        return None
+    try:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', bbox_inches='tight')
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def show_chart(result, name):
+    png = render_png(result, name)
+    if png:
+        st.image(png)
 
 def set_background():
     # CSS to set the background image with overlay and black text
@@ -33,6 +206,9 @@ def set_background():
 
 
 def create_visualizations(result, name):
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
     plt.style.use('ggplot')
     fig = None
 
@@ -147,6 +323,21 @@ def create_visualizations(result, name):
             axes[2].legend()
             axes[2].grid(axis='y', linestyle='--', alpha=0.7)
 
+    elif name == 'hour_weekday':
+        import rollups
+
+        matrix = result.pivot(index='weekday', columns='hour', values='trips')
+        matrix = matrix.reindex(index=range(1, 8), columns=range(24)).fillna(0)
+        fig, ax = plt.subplots(figsize=(15, 6))
+        image = ax.imshow(matrix.to_numpy(), aspect='auto', cmap='YlOrRd')
+        ax.set_title('Trips by Hour of Day and Day of Week', fontsize=14, fontweight='bold')
+        ax.set_xlabel('Hour of Day', fontsize=12)
+        ax.set_ylabel('Day of Week', fontsize=12)
+        ax.set_xticks(range(24))
+        ax.set_yticks(range(7))
+        ax.set_yticklabels(rollups.WEEKDAYS)
+        fig.colorbar(image, ax=ax, label='Trips')
+
     return fig
 
 
@@ -199,120 +390,356 @@ def show_story():
     that are built to perform and built to last.
     """)
 
-def show_growth_rate_analysis(conn):
+def show_growth_rate_analysis(data_version, pool=None):
     st.markdown("## The Growth Rate of Cyclists - Interactive")
-    df_growth = pd.read_sql_query("SELECT * FROM the_growth_rate_of_cyclists_results", conn)
-    if not df_growth.empty:
-        all_years = sorted(df_growth['st_year'].unique())
-        if len(all_years) > 1:
-            min_year, max_year = int(min(all_years)), int(max(all_years))
+    if pool:
+        import live_queries  # pulls in DuckDB, so only in live mode
+
+        min_year, max_year = live_queries.year_range(pool, data_version)
+    else:
+        min_year, max_year = load_column_range(data_version, GROWTH_TABLE, 'st_year')
+    if min_year is not None:
+        min_year, max_year = int(min_year), int(max_year)
+        year_range = (min_year, max_year)
+        if max_year > min_year:
             st.markdown("### Select Year Range:")
             year_range = st.slider("", min_value=min_year, max_value=max_year, value=(min_year, max_year))
-            df_growth_filtered = df_growth[
-                (df_growth['st_year'] >= year_range[0]) &
-                (df_growth['st_year'] <= year_range[1])
-                ]
+        if pool:
+            # Growth is measured from the first selected year
+            df_growth_filtered = live_queries.growth_rate(pool, year_range[0], year_range[1], data_version)
+            df_growth_filtered['st_year'] = df_growth_filtered['st_year'].astype(str)
         else:
-            df_growth_filtered = df_growth
+            df_growth_filtered = load_growth_page(data_version, year_range)
 
-        df_growth_filtered['st_year'] = df_growth_filtered['st_year'].astype(str)
         st.dataframe(df_growth_filtered.head(10))
-        fig1 = create_visualizations(df_growth_filtered, 'the_growth_rate_of_cyclists')
-        if fig1:
-            st.pyplot(fig1)
+        show_chart(df_growth_filtered, 'the_growth_rate_of_cyclists')
 
 
-def show_gender_analysis(conn):
+def show_gender_analysis(data_version):
     st.subheader("Travel Duration According to Gender")
-    df_gender = pd.read_sql_query("SELECT * FROM Travel_duration_according_gender_results", conn)
+    df_gender = load_page(data_version, "Travel_duration_according_gender_results")
     st.dataframe(df_gender.head(10))
-    fig2 = create_visualizations(df_gender, 'Travel_duration_according_gender')
-    if fig2:
-        st.pyplot(fig2)
+    show_chart(df_gender, 'Travel_duration_according_gender')
 
 
-def show_popular_stations(conn):
+def show_popular_stations(data_version):
     st.subheader("Popular Stations")
-    df_stations = pd.read_sql_query("SELECT * FROM Popular_Stations_results", conn)
-    df_stations_top10 = df_stations.sort_values('total_rides', ascending=False).head(10)
+    df_stations_top10 = load_page(data_version, "Popular_Stations_results",
+                                  order_by='total_rides', descending=True, limit=10)
     st.dataframe(df_stations_top10)
-    fig3 = create_visualizations(df_stations_top10, 'Popular_Stations')
-    if fig3:
-        st.pyplot(fig3)
+    show_chart(df_stations_top10, 'Popular_Stations')
 
 
-def show_age_analysis(conn):
-    st.subheader("Age Target of the Company - Interactive")
-    df_age = pd.read_sql_query("SELECT * FROM What_are_the_Age_target_of_the_company_results", conn)
-
-    if not df_age.empty:
-        # Define the correct order of age groups
-        age_order = ['Under 25', '25-35', '36-50', 'Over 50']
+def show_age_analysis(data_version, pool=None):
+    import pandas as pd
 
-        # Convert age_group to categorical with custom order
-        df_age['age_group'] = pd.Categorical(df_age['age_group'],
-                                             categories=age_order,
-                                             ordered=True)
+    st.subheader("Age Target of the Company - Interactive")
+    table = "What_are_the_Age_target_of_the_company_results"
 
-        # Sort the dataframe by the ordered age_group
-        df_age = df_age.sort_values('age_group')
+    # Define the correct order of age groups
+    age_order = ['Under 25', '25-35', '36-50', 'Over 50']
 
-        # Get unique age groups in the correct order
-        all_groups = df_age['age_group'].unique().tolist()
+    # Get the age groups present, in the correct order
+    present = age_order if pool else load_distinct_values(data_version, table, 'age_group')
+    all_groups = [group for group in age_order if group in present]
 
+    if all_groups:
         # Create multiselect with ordered options
         chosen_groups = st.multiselect("Select which age groups:",
                                        options=all_groups,
                                        default=all_groups)
-        # Filter and maintain the order
-        df_age_filtered = df_age[df_age['age_group'].isin(chosen_groups)]
+        # Only the chosen groups are read from SQLite (or counted in DuckDB in live mode)
+        if pool:
+            import live_queries
+
+            df_age_filtered = live_queries.rides_by_age_group(pool, chosen_groups, data_version)
+        else:
+            df_age_filtered = load_page(data_version, table, filters={'age_group': chosen_groups})
+
+        # Convert age_group to categorical with custom order and keep that order
+        df_age_filtered['age_group'] = pd.Categorical(df_age_filtered['age_group'],
+                                                      categories=age_order,
+                                                      ordered=True)
+        df_age_filtered = df_age_filtered.sort_values('age_group')
 
         st.dataframe(df_age_filtered)
-        fig4 = create_visualizations(df_age_filtered, 'What_are_the_Age_target_of_the_company')
-        if fig4:
-            st.pyplot(fig4)
+        show_chart(df_age_filtered, 'What_are_the_Age_target_of_the_company')
 
 
-def show_temporal_analysis(conn):
+def show_temporal_analysis(data_version):
     st.subheader("The Month and the Day of Trips")
-    df_periods = pd.read_sql_query("SELECT * FROM the_Month_and_the_day_of_trips_results", conn)
+    df_periods = load_page(data_version, "the_Month_and_the_day_of_trips_results", order_by='period_type')
     st.dataframe(df_periods.head(20))
-    fig5 = create_visualizations(df_periods, 'the_Month_and_the_day_of_trips')
-    if fig5:
-        st.pyplot(fig5)
+    show_chart(df_periods, 'the_Month_and_the_day_of_trips')
 
 
-def show_analytics():
+def show_station_network(data_version):
+    st.subheader("Station Network")
+    st.caption("Stations ranked by PageRank over the trip network: a station ranks high when "
+               "riders arrive from other well-connected stations, not just when many trips start there.")
+    table = "station_centrality_results"
+    try:
+        top_n = st.slider("Stations:", min_value=5, max_value=50, value=10)
+        df_network = load_page(data_version, table, order_by='pagerank_rank', limit=top_n)
+    except ValueError:
+        st.info("No network rankings yet. Run data_analyzer.py to compute them.")
+        return
+    st.dataframe(df_network)
+    if not df_network.empty:
+        st.bar_chart(df_network, x='station_name', y='pagerank')
+        components = load_distinct_values(data_version, table, 'component')
+        st.write(f"{len(components)} connected component(s) in the network.")
+
+
+def show_duration_percentiles(data_version):
+    import sketches
+
+    st.subheader("Trip Duration Percentiles")
+    st.caption("Merged from small monthly sketches instead of rescanning the trips; "
+               f"durations are within {sketches.RELATIVE_ACCURACY:.0%} and station counts are exact.")
+    try:
+        months = load_distinct_values(data_version, "trip_sketch_results", 'month_key', {'dimension': 'all'})
+    except ValueError:
+        st.info("No sketches yet. Run data_analyzer.py to build them.")
+        return
+    if not months:
+        st.info("No sketches yet. Run data_analyzer.py to build them.")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        dimension = st.selectbox("Group by:", sketches.DIMENSIONS, key="sketch_dimension")
+    with col2:
+        values = ['all'] if dimension == 'all' else load_distinct_values(
+            data_version, "trip_sketch_results", 'value', {'dimension': dimension})
+        value = st.selectbox("Value:", values, key="sketch_value")
+    first, last = months[0], months[-1]
+    if last > first:
+        first, last = st.select_slider("Months:", options=months, value=(first, last),
+                                       format_func=lambda m: f"{m // 100}-{m % 100:02d}")
+
+    filters = sketches.sketch_filters(dimension, value, (first, last))
+    sketch = load_page(data_version, "trip_sketch_results", columns=['trips', 'durations', 'end_stations'],
+                       filters=filters)
+    quantiles = sketches.duration_quantiles(sketch)
+
+    columns = st.columns(5)
+    columns[0].metric("Trips", f"{int(sketch['trips'].sum()):,}")
+    for column, (q, seconds) in zip(columns[1:], quantiles.items()):
+        column.metric(f"p{q * 100:g}", "-" if seconds is None else f"{seconds / 60:.1f} min")
+    columns[4].metric("End stations", f"{sketches.distinct_end_stations(sketch):,}")
+
+
+def show_time_patterns(data_version):
+    import pandas as pd
+    import rollups
+
+    st.subheader("Time Patterns")
+    st.caption("Served from hourly rollups of the trip start times.")
+    try:
+        grains = load_distinct_values(data_version, "time_rollup_results", 'grain')
+    except ValueError:
+        st.info("No time rollups yet. Run data_analyzer.py to build them.")
+        return
+    grains = [grain for grain in ['hour'] + list(rollups.ROLLUP_GRAINS) if grain in grains]
+    if not grains:
+        st.info("No time rollups yet. Run data_analyzer.py to build them.")
+        return
+
+    grain = st.selectbox("Trips per:", grains, index=grains.index('day') if 'day' in grains else 0)
+    df_trend = load_page(data_version, "time_rollup_results", columns=['period_start', 'trips', 'mean_duration'],
+                         filters={'grain': grain}, order_by='period_start')
+    df_trend['period_start'] = pd.to_datetime(df_trend['period_start'])
+    st.line_chart(df_trend, x='period_start', y='trips')
+
+    st.markdown("### Hour of Day by Day of Week")
+    df_matrix = load_page(data_version, "hour_weekday_results")
+    show_chart(df_matrix, 'hour_weekday')
+
+
+def show_live_explorer(pool, data_version):
+    import live_queries
+
+    st.subheader("Live Explorer")
+    st.caption("Queries run directly against the full trip table in DuckDB.")
+
+    first_day, last_day = live_queries.date_range(pool, data_version)
+    col1, col2 = st.columns(2)
+    with col1:
+        dates = st.date_input("Trip dates:", value=(first_day, last_day),
+                              min_value=first_day, max_value=last_day)
+        station = st.selectbox("Start station:", ["All stations"] + live_queries.station_names(pool, data_version))
+    with col2:
+        usertype = st.selectbox("User type:", ["All", 0, 1])
+        group_by = st.selectbox("Group by:", list(live_queries.GROUPINGS))
+
+    # The date picker returns a single date while the user is mid-selection
+    start_date, end_date = (dates[0], dates[-1]) if isinstance(dates, (list, tuple)) else (dates, dates)
+    filters = {
+        'start_date': start_date,
+        'end_date': end_date,
+        'station': None if station == "All stations" else station,
+        'usertype': None if usertype == "All" else usertype,
+    }
+    df_slice = live_queries.slice_trips(pool, group_by, filters, data_version=data_version)
+    st.write(f"{len(df_slice):,} groups")
+    st.dataframe(df_slice)
+    if not df_slice.empty:
+        st.bar_chart(df_slice, x=group_by, y='total_trips')
+
+
+def show_analytics(live_mode=False):
     st.title("Analytics")
-    conn = sqlite3.connect("sqlite_file.sqlite")
+    data_version = get_data_version()
+
+    pool = None
+    if live_mode:
+        try:
+            pool = get_live_pool()
+            pool.check()
+        except Exception as e:
+            pool = None
+            st.error(f"Live mode unavailable, showing precomputed results: {e}")
+
+    # Only the selected section is queried and plotted on each rerun
+    sections = {
+        "Growth Rate": lambda: show_growth_rate_analysis(data_version, pool),
+        "Gender": lambda: show_gender_analysis(data_version),
+        "Popular Stations": lambda: show_popular_stations(data_version),
+        "Station Network": lambda: show_station_network(data_version),
+        "Trip Durations": lambda: show_duration_percentiles(data_version),
+        "Age Groups": lambda: show_age_analysis(data_version, pool),
+        "Months & Days": lambda: show_temporal_analysis(data_version),
+        "Time Patterns": lambda: show_time_patterns(data_version),
+    }
+    if pool:
+        sections["Live Explorer"] = lambda: show_live_explorer(pool, data_version)
+    section = st.radio("Section", list(sections), horizontal=True, key="analytics_section")
 
-    show_growth_rate_analysis(conn)
-    show_gender_analysis(conn)
-    show_popular_stations(conn)
-    show_age_analysis(conn)
-    show_temporal_analysis(conn)
-
-    conn.close()
+    try:
+        sections[section]()
+    except (TimeoutError, ConnectionError) as e:
+        st.error(str(e))
 
 
 # Add this new function to display small_data
 def show_small_data():
     st.title("Small Data Overview")
+    table = "small_data"
     try:
-        # Connect to SQLite database
-        conn = sqlite3.connect("sqlite_file.sqlite")
-
-        # Read the small_data table
-        df = pd.read_sql_query("SELECT * FROM small_data", conn)
-
-        st.write(f"Total Records: {len(df):,}")
+        data_version = get_data_version()
+        types = load_column_types(data_version, table)
+        all_columns = list(types)
+
+        # Column projection, sort and filter are all applied in SQLite
+        columns = st.multiselect("Columns:", all_columns, default=all_columns)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            sort_column = st.selectbox("Sort by:", ["Row order"] + all_columns)
+            descending = st.checkbox("Descending")
+        with col2:
+            filter_column = st.selectbox("Filter column:", ["No filter"] + all_columns)
+            operator = st.selectbox("Operator:", ["=", "!=", "<", "<=", ">", ">=", "contains"])
+        with col3:
+            filter_value = st.text_input("Value:")
+            page_size = st.selectbox("Rows per page:", [50, 100, 500], index=1)
+
+        filters = []
+        if filter_column != "No filter" and filter_value != "":
+            value = filter_value
+            if operator != "contains" and types[filter_column] in ("INTEGER", "REAL"):
+                value = float(filter_value) if types[filter_column] == "REAL" else int(filter_value)
+            filters.append((filter_column, operator, value))
+        sort_column = None if sort_column == "Row order" else sort_column
+
+        # Keys of the pages visited so far; a new query starts again at page one
+        query = (data_version, tuple(columns), sort_column, descending, tuple(filters), page_size)
+        if st.session_state.get("small_data_query") != query:
+            st.session_state["small_data_query"] = query
+            st.session_state["small_data_keys"] = [None]
+        keys = st.session_state["small_data_keys"]
+
+        df, next_key = load_keyset_page(data_version, table, columns or None, filters, sort_column,
+                                        descending, keys[-1], page_size)
+
+        total = load_row_count(data_version, table, filters)
+        st.write(f"Total Records: {total:,} | Page {len(keys)}")
         st.dataframe(df)
-        conn.close()
 
+        prev_col, next_col = st.columns(2)
+        if prev_col.button("Previous page", disabled=len(keys) == 1):
+            keys.pop()
+            st.rerun()
+        if next_col.button("Next page", disabled=next_key is None):
+            keys.append(next_key)
+            st.rerun()
+
+    except ValueError as e:
+        st.error(f"Invalid filter: {e}")
     except Exception as e:
         st.error(f"Error loading data: {e}")
 
 
+# How many recordings (a data_analyzer.py run or a stream batch each) the
+# Performance page reads; query_metrics keeps growing, so older ones stay in SQLite
+METRICS_HISTORY = 100
+
+
+def show_performance():
+    import pandas as pd
+
+    st.title("Performance")
+    st.caption(f"Timings recorded by the last {METRICS_HISTORY} data_analyzer.py runs and stream batches, "
+               "to spot the report that slows down as data grows.")
+    # Runs that skip every report still record metrics, so key on their own marker
+    metrics_version = get_pipeline_meta('metrics_version')
+    try:
+        metrics = load_latest(metrics_version, "query_metrics", 'recorded_at', METRICS_HISTORY)
+    except ValueError:
+        st.info("No metrics recorded yet. Run data_analyzer.py to collect them.")
+        return
+    if metrics.empty:
+        st.info("No metrics recorded yet. Run data_analyzer.py to collect them.")
+        return
+
+    metrics['recorded_at'] = pd.to_datetime(metrics['recorded_at'])
+    metrics['peak_memory_mb'] = metrics['peak_memory_bytes'] / 2**20
+    # Normalizing by the size of divvy_data separates regressions from growth
+    metrics['seconds_per_million_rows'] = metrics['wall_seconds'] / (metrics['source_rows'] / 1e6)
+
+    stages = sorted(metrics['stage'].unique())
+    col1, col2 = st.columns(2)
+    with col1:
+        stage = st.selectbox("Stage:", stages, index=stages.index('query') if 'query' in stages else 0)
+    with col2:
+        measure = st.selectbox("Measure:", ['wall_seconds', 'seconds_per_million_rows',
+                                            'peak_memory_mb', 'cpu_seconds', 'rows'])
+
+    # One line per report across all runs
+    history = metrics[metrics['stage'] == stage].pivot_table(
+        index='recorded_at', columns='name', values=measure, aggfunc='sum')
+    st.line_chart(history)
+
+    # Latest run next to the one before it
+    runs = metrics.drop_duplicates('run_id', keep='last')['run_id'].tolist()
+    latest = metrics[metrics['run_id'] == runs[-1]].set_index(['stage', 'name'])
+    table = latest[['wall_seconds', 'rows', 'source_rows', 'peak_memory_mb']].copy()
+    if len(runs) > 1:
+        previous = metrics[metrics['run_id'] == runs[-2]].set_index(['stage', 'name'])
+        table['previous_wall_seconds'] = previous['wall_seconds']
+        table['change'] = table['wall_seconds'] / table['previous_wall_seconds']
+    st.subheader(f"Latest run ({latest['recorded_at'].iloc[0]:%Y-%m-%d %H:%M})")
+    st.dataframe(table.reset_index())
+
+    # Operator profile of one report, slowest operators first
+    profiled = latest[latest['profile'].notna()].reset_index()
+    if not profiled.empty:
+        choice = st.selectbox("Operator profile:", (profiled['stage'] + ' / ' + profiled['name']).tolist())
+        profile = profiled.loc[(profiled['stage'] + ' / ' + profiled['name']) == choice, 'profile'].iloc[0]
+        operators = pd.DataFrame(json.loads(profile))
+        st.dataframe(operators.sort_values('seconds', ascending=False).head(15))
+
+
 def show_about_us():
     st.title("About Us")
 
@@ -355,19 +782,25 @@ def show_about_us():
 # Modify the main function to include the new option
 def main():
     set_background()
+    if PREWARM:
+        start_prewarm()
 
     st.sidebar.title("Navigation")
     # Add "Small Data" to the radio options
-    page = st.sidebar.radio("Go to", ["Story", "Questions", "Analytics", "Small Data", "About Us"])
+    page = st.sidebar.radio("Go to", ["Story", "Questions", "Analytics", "Small Data", "Performance", "About Us"],
+                            key="page")
+    live_mode = st.sidebar.checkbox("Live mode (query the full dataset)", value=False)
 
     if page == "Story":
         show_story()
     elif page == "Questions":
         show_questions()
     elif page == "Analytics":
-        show_analytics()
+        show_analytics(live_mode)
     elif page == "Small Data":
         show_small_data()
+    elif page == "Performance":
+        show_performance()
     elif page == "About Us":
         show_about_us()
 
@@ -1,14 +1,102 @@
+import argparse
+import hashlib
+import json
+import os
 import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
 import duckdb
 
+import config
+import od_flows
+import rollups
+import schema
+import sketches
+import station_graph
+import stations
+
+# Where the cube reads its trips from: the narrow star schema built by
+# schema.py (integer keys into small dimension tables), or divvy_data itself.
+CUBE_SOURCES = {
+    'star': schema.STAR_CUBE_SOURCE,
+    'wide': """
+        SELECT st_year, st_month, st_day, gender, start_station_name, trip_duration, age
+        FROM divvy_data
+    """,
+}
+
+# The same for a batch of new trips in `{trips}` (see merge_into_cube), with
+# every column named as the matching CUBE_SOURCES entry names it
+CUBE_BATCH_SOURCES = {
+    'star': schema.STAR_CUBE_BATCH_SOURCE,
+    'wide': """
+        SELECT st_year, st_month, st_day, gender, start_station_name, trip_duration, age
+        FROM {trips}
+    """,
+}
+
+# One shared scan of the trips: every grouping set below is one "grain" of the
+# cube, and all reports in `queries` are derived from it instead of divvy_data.
+# Every measure is a count or a sum, so cubes of separate batches of trips add up.
+CUBE_KEYS = ['grain', 'st_year', 'st_month', 'st_day', 'gender', 'age_group', 'start_station_name']
+
+CUBE_SELECT = """
+    SELECT
+        CASE
+            WHEN GROUPING(st_year) = 0 THEN 'year'
+            WHEN GROUPING(st_month) = 0 THEN 'month'
+            WHEN GROUPING(st_day) = 0 THEN 'day'
+            WHEN GROUPING(gender) = 0 THEN 'gender'
+            WHEN GROUPING(age_group) = 0 THEN 'age_group'
+            ELSE 'station'
+        END AS grain,
+        st_year,
+        st_month,
+        st_day,
+        gender,
+        age_group,
+        start_station_name,
+        COUNT(*) AS trips,
+        COUNT(trip_duration) AS duration_count,
+        SUM(trip_duration) AS duration_sum,
+        -- measures for the gender report, which ignores trips of two hours or more
+        COUNT(*) FILTER (WHERE trip_duration < 7200) AS capped_trips,
+        SUM(trip_duration) FILTER (WHERE trip_duration < 7200) AS capped_duration_sum,
+        COUNT(*) FILTER (WHERE trip_duration > 1800 AND trip_duration < 7200) AS capped_long_trips
+    FROM (
+        SELECT 
+            st_year,
+            st_month,
+            st_day,
+            gender,
+            start_station_name,
+            trip_duration,
+            CASE 
+                WHEN age < 25 THEN 'Under 25'
+                WHEN age BETWEEN 25 AND 35 THEN '25-35'
+                WHEN age BETWEEN 36 AND 50 THEN '36-50'
+                ELSE 'Over 50'
+            END AS age_group
+        FROM ({source})
+    )
+    GROUP BY GROUPING SETS (
+        (st_year), (st_month), (st_day), (gender), (age_group), (start_station_name)
+    )
+"""
+
+CUBE_QUERY = "CREATE OR REPLACE TABLE divvy_cube AS" + CUBE_SELECT
+
 queries = {
     'The_growth_rate_of_cyclists': """
         WITH yearly_totals AS (
             SELECT 
                 st_year,
-                COUNT(*) AS total_rides
-            FROM divvy_data
-            GROUP BY st_year
+                trips AS total_rides
+            FROM divvy_cube
+            WHERE grain = 'year'
             ORDER BY st_year
         ),
         growth_calc AS (
@@ -27,18 +115,16 @@ queries = {
     """,
 
     'Popular_Stations': """
-       WITH popular_stations AS (
+       WITH station_totals AS (
            SELECT start_station_name, 
-               COUNT(*) as total_rides,
-               AVG(trip_duration) as avg_ride_minutes
-           FROM divvy_data
-           GROUP BY start_station_name
-           HAVING COUNT(*) > (
-               SELECT AVG(ride_count)
-               FROM (SELECT COUNT(*) as ride_count 
-                     FROM divvy_data 
-                     GROUP BY start_station_name)
-           )
+               trips as total_rides,
+               duration_sum / duration_count as avg_ride_minutes
+           FROM divvy_cube
+           WHERE grain = 'station'
+       ),
+       popular_stations AS (
+           SELECT * FROM station_totals
+           WHERE total_rides > (SELECT AVG(total_rides) FROM station_totals)
        )
        SELECT * FROM popular_stations
    """,
@@ -49,38 +135,33 @@ queries = {
                WHEN gender = 0 THEN 'Male'
                WHEN gender = 1 THEN 'Female'
            END as gender,
-           COUNT(*) as total_trips,
-           AVG(trip_duration/60) as avg_duration_minutes,
-           COUNT(CASE WHEN trip_duration > 1800 THEN 1 END) as long_trips,
-           ROUND(COUNT(CASE WHEN trip_duration > 1800 THEN 1 END) * 100.0 / COUNT(*), 2) as long_trip_percentage
-        FROM divvy_data
-        WHERE trip_duration < 7200 
+           capped_trips as total_trips,
+           capped_duration_sum / 60 / capped_trips as avg_duration_minutes,
+           capped_long_trips as long_trips,
+           ROUND(capped_long_trips * 100.0 / capped_trips, 2) as long_trip_percentage
+        FROM divvy_cube
+        WHERE grain = 'gender'
+        AND capped_trips > 0
         AND gender IN (0, 1)  -- הסרת -1
-        GROUP BY gender
         ORDER BY gender;
    """,
 
     'What_are_the_Age_target_of_the_company': """
         SELECT 
-            CASE 
-                WHEN age < 25 THEN 'Under 25'
-                WHEN age BETWEEN 25 AND 35 THEN '25-35'
-                WHEN age BETWEEN 36 AND 50 THEN '36-50'
-                ELSE 'Over 50'
-            END as age_group,
-            COUNT(*) as total_rides
-        FROM divvy_data
-        GROUP BY age_group;
+            age_group,
+            trips as total_rides
+        FROM divvy_cube
+        WHERE grain = 'age_group';
    """,
 
     'The_Month_and_the_day_of_trips': """
         WITH daily_stats AS (
         SELECT 
             st_day,
-            COUNT(*) AS daily_trips,
-            AVG(trip_duration/60) AS daily_avg_duration
-        FROM divvy_data
-        GROUP BY st_day
+            trips AS daily_trips,
+            duration_sum / 60 / duration_count AS daily_avg_duration
+        FROM divvy_cube
+        WHERE grain = 'day'
     ),
     top_five_days AS (
         SELECT st_day, daily_trips, daily_avg_duration
@@ -106,10 +187,10 @@ queries = {
                 WHEN st_month = 11 THEN 'November'
                 WHEN st_month = 12 THEN 'December'
             END AS month_name,
-            COUNT(*) AS monthly_trips,
-            AVG(trip_duration/60) AS monthly_avg_duration
-        FROM divvy_data
-        GROUP BY st_month
+            trips AS monthly_trips,
+            duration_sum / 60 / duration_count AS monthly_avg_duration
+        FROM divvy_cube
+        WHERE grain = 'month'
     ),
     top_five_months AS (
         SELECT st_month, month_name, monthly_trips, monthly_avg_duration
@@ -121,10 +202,10 @@ queries = {
     yearly_stats AS (
         SELECT 
             st_year,
-            COUNT(*) AS yearly_trips,
-            AVG(trip_duration/60) AS yearly_avg_duration
-        FROM divvy_data
-        GROUP BY st_year
+            trips AS yearly_trips,
+            duration_sum / 60 / duration_count AS yearly_avg_duration
+        FROM divvy_cube
+        WHERE grain = 'year'
     ),
     top_five_years AS (
         SELECT st_year, yearly_trips, yearly_avg_duration
@@ -171,72 +252,634 @@ queries = {
     """
 }
 
-def load_csv_to_sqlite(csv_file, sqlite_db, table_name):
+# SQLite column types of Small_data.csv (the unnamed first column is the
+# pandas index of the original export) and the pandas dtypes used to stream it
+SMALL_DATA_COLUMNS = {
+    'Unnamed: 0': 'INTEGER',
+    'start_time': 'TEXT', 'end_time': 'TEXT',
+    'trip_duration': 'INTEGER',
+    'start_station_id': 'TEXT', 'start_station_name': 'TEXT',
+    'end_station_id': 'TEXT', 'end_station_name': 'TEXT',
+    'usertype': 'INTEGER', 'gender': 'INTEGER',
+    'start_lat': 'REAL', 'start_lng': 'REAL', 'end_lat': 'REAL', 'end_lng': 'REAL',
+    'rideable_type': 'INTEGER',
+    'start_city': 'INTEGER', 'start_landmark': 'INTEGER',
+    'end_city': 'INTEGER', 'end_landmark': 'INTEGER',
+    'start_date': 'TEXT', 'end_date': 'TEXT',
+    'start_dpcapacity': 'INTEGER', 'end_dpcapacity': 'INTEGER',
+    'age': 'INTEGER',
+    'st_hour': 'INTEGER', 'st_minute': 'INTEGER', 'st_second': 'INTEGER',
+    'ed_hour': 'INTEGER', 'ed_minute': 'INTEGER', 'ed_second': 'INTEGER',
+    'st_year': 'INTEGER', 'st_month': 'INTEGER', 'st_day': 'INTEGER',
+    'ed_year': 'INTEGER', 'ed_month': 'INTEGER', 'ed_day': 'INTEGER',
+}
+PANDAS_DTYPES = {'INTEGER': 'Int64', 'REAL': 'float64', 'TEXT': 'string'}
+SMALL_DATA_INDEXES = ['st_year', 'start_station_name']
+
+# Columns of each exported table that the dashboard filters or sorts on;
+# export_report builds a SQLite index on each of them (a tuple of columns
+# gets one index over all of them).
+RESULT_INDEXES = {
+    'The_growth_rate_of_cyclists': ['st_year'],
+    'Popular_Stations': ['total_rides'],
+    'Travel_duration_according_gender': [],
+    'What_are_the_Age_target_of_the_company': ['age_group', 'total_rides'],
+    'The_Month_and_the_day_of_trips': ['period_type'],
+    'station_centrality': ['pagerank_rank'],
+    'trip_sketch': [('dimension', 'value', 'month_key')],
+    'time_rollup': ['grain'],
+    'hour_weekday': [],
+}
+
+# Bump whenever the shape of the exported tables changes, so cached exports are rebuilt
+EXPORT_FORMAT_VERSION = '7'
+
+# Tables earlier versions exported that nothing reads any more
+RETIRED_TABLES = ['duration_sketch_results', 'station_hll_results']
+
+def load_csv_to_sqlite(csv_file, sqlite_db, table_name, column_types=None, index_columns=(),
+                       chunksize=100_000, rows_per_transaction=1_000_000):
     """
     Load a CSV file into SQLite database
+    The file is streamed in chunks of `chunksize` rows with explicit dtypes, so
+    memory stays flat however large it is. Rows go into a staging table through
+    executemany with bulk-load pragmas; the staging table replaces `table_name`
+    and gets its indexes only once everything is in.
     Returns:
     bool: True if successful, False if failed
     """
     try:
         import pandas as pd
 
-        # Read the CSV file
-        df = pd.read_csv(csv_file)
+        column_types = column_types or SMALL_DATA_COLUMNS
+        header = pd.read_csv(csv_file, nrows=0).columns.tolist()
+        sql_types = {column: column_types.get(column, 'TEXT') for column in header}
+        dtypes = {column: PANDAS_DTYPES[sql_type] for column, sql_type in sql_types.items()}
+
+        staging = f"{table_name}__loading"
+        columns_sql = ', '.join(f'"{column}" {sql_type}' for column, sql_type in sql_types.items())
+        insert_sql = f'INSERT INTO "{staging}" VALUES ({", ".join("?" for _ in header)})'
 
         # Connect to SQLite and load the data
         with sqlite3.connect(sqlite_db) as sqlite_conn:
-            df.to_sql(table_name, sqlite_conn, if_exists='replace', index=False)
-            print(f"Successfully loaded {csv_file} into SQLite table '{table_name}'.")
+            journal_mode = sqlite_conn.execute("PRAGMA journal_mode").fetchone()[0]
+            sqlite_conn.execute("PRAGMA journal_mode = MEMORY")
+            sqlite_conn.execute("PRAGMA synchronous = OFF")
+            sqlite_conn.execute("PRAGMA cache_size = -262144")  # 256 MB
+            sqlite_conn.execute("PRAGMA temp_store = MEMORY")
+
+            sqlite_conn.execute(f'DROP TABLE IF EXISTS "{staging}"')
+            sqlite_conn.execute(f'CREATE TABLE "{staging}" ({columns_sql})')
+
+            rows = pending = 0
+            start = time.perf_counter()
+            for chunk in pd.read_csv(csv_file, chunksize=chunksize, dtype=dtypes):
+                values = [chunk[column].to_numpy(dtype=object, na_value=None) for column in header]
+                sqlite_conn.executemany(insert_sql, zip(*values))
+                rows += len(chunk)
+                pending += len(chunk)
+                if pending >= rows_per_transaction:
+                    sqlite_conn.commit()
+                    pending = 0
+
+            # Swap the staging table in, then index it
+            sqlite_conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            sqlite_conn.execute(f'ALTER TABLE "{staging}" RENAME TO "{table_name}"')
+            for column in index_columns:
+                sqlite_conn.execute(f'CREATE INDEX "idx_{table_name}_{column}" ON "{table_name}" ("{column}")')
+            # Row count for the dashboard, so it never has to COUNT(*) the table
+            set_pipeline_meta(sqlite_conn, f'row_count:{table_name}', rows)
+            sqlite_conn.commit()
+
+            sqlite_conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+            elapsed = time.perf_counter() - start
+            print(f"Successfully loaded {csv_file} into SQLite table '{table_name}' "
+                  f"({rows} rows, {rows / max(elapsed, 1e-9):,.0f} rows/s).")
         return True
 
     except Exception as e:
         print(f"Error loading CSV to SQLite: {e}")
         return False
 
-def run_queries():
+# Functions for the fingerprint-keyed result cache
+def ensure_result_cache(sqlite_conn):
+    """Create the table that remembers which inputs each exported table was built from."""
+    sqlite_conn.execute("""
+        CREATE TABLE IF NOT EXISTS result_cache (
+            name TEXT PRIMARY KEY,
+            cache_key TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
 
-    # First load the CSV into SQLite
-    if not load_csv_to_sqlite('Small_data.CSV', 'sqlite_file.sqlite', 'small_data'):
-        print("Failed to load CSV file. Aborting queries.")
+
+def source_fingerprint(duckdb_conn):
+    """
+    Describe the current contents of divvy_data: the ingest manifest when there
+    is one, plus the row count and DuckDB's own size estimate of the table.
+    """
+    parts = [str(duckdb_conn.execute("SELECT COUNT(*) FROM divvy_data").fetchone()[0])]
+    has_manifest = duckdb_conn.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'ingest_manifest'").fetchone()[0]
+    if has_manifest:
+        parts += [repr(row) for row in duckdb_conn.execute("""
+            SELECT path, size, mtime, content_hash, row_count FROM ingest_manifest ORDER BY path
+        """).fetchall()]
+    parts += [repr(row) for row in duckdb_conn.execute("""
+        SELECT estimated_size, column_count FROM duckdb_tables() WHERE table_name = 'divvy_data'
+    """).fetchall()]
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+def cache_key(*parts):
+    """Hash the query text(s) and fingerprint that a cached table depends on."""
+    return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+
+def small_data_cache_key(csv_file):
+    """Cache key of the small_data table: the CSV's path, size and modification time."""
+    stat = os.stat(csv_file) if os.path.exists(csv_file) else None
+    return cache_key(EXPORT_FORMAT_VERSION, csv_file, repr(stat and (stat.st_size, stat.st_mtime)))
+
+
+def report_cache_key(name, fingerprint, cube_source):
+    """Cache key of one report: the cube and report queries and the source fingerprint."""
+    return cache_key(EXPORT_FORMAT_VERSION, CUBE_QUERY, CUBE_SOURCES[cube_source], queries[name], fingerprint)
+
+
+def is_cached(sqlite_conn, name, key):
+    """Return True if `name` was exported from exactly these inputs and is still in SQLite."""
+    row = sqlite_conn.execute("SELECT cache_key FROM result_cache WHERE name = ?", (name,)).fetchone()
+    if not row or row[0] != key:
+        return False
+    table = sqlite_conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE",
+        (name if name == 'small_data' else f"{name}_results",)).fetchone()
+    return table is not None
+
+
+def store_cache_entry(sqlite_conn, name, key):
+    """Record that `name` is now up to date for the given key."""
+    sqlite_conn.execute("""
+        INSERT OR REPLACE INTO result_cache (name, cache_key, created_at)
+        VALUES (?, ?, datetime('now'))
+    """, (name, key))
+    sqlite_conn.commit()
+
+
+def set_pipeline_meta(sqlite_conn, key, value):
+    """Store a key/value pair in the pipeline_meta table the dashboard reads (not committed)."""
+    sqlite_conn.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    sqlite_conn.execute("""
+        INSERT OR REPLACE INTO pipeline_meta (key, value) VALUES (?, ?)
+    """, (key, str(value)))
+
+
+def bump_data_version(sqlite_conn):
+    """
+    Store a new data_version marker in pipeline_meta; the dashboard keys its
+    caches on it, so they are invalidated exactly when exported results change.
+    """
+    set_pipeline_meta(sqlite_conn, 'data_version', uuid.uuid4().hex)
+    sqlite_conn.commit()
+
+
+def evict_stale_entries(sqlite_conn):
+    """
+    Drop cache entries, and their exported tables, for reports no longer in
+    `queries`, and the RETIRED_TABLES left behind by earlier versions.
+    """
+    known = set(queries) | {'small_data'}
+    evicted = False
+    for (name,) in sqlite_conn.execute("SELECT name FROM result_cache").fetchall():
+        if name not in known:
+            sqlite_conn.execute(f'DROP TABLE IF EXISTS "{name}_results"')
+            sqlite_conn.execute("DELETE FROM result_cache WHERE name = ?", (name,))
+            print(f"Evicted stale cache entry {name}.")
+            evicted = True
+    retired = [table for table in RETIRED_TABLES if sqlite_conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()]
+    for table in retired:
+        sqlite_conn.execute(f'DROP TABLE "{table}"')
+        print(f"Dropped retired table {table}.")
+        evicted = True
+    sqlite_conn.commit()
+    if retired:
+        # They can be most of the file, so give the space back once
+        sqlite_conn.execute("VACUUM")
+    if evicted:
+        bump_data_version(sqlite_conn)
+
+
+# Functions for per-query metrics
+def ensure_query_metrics(sqlite_conn):
+    """Create the run-history table that every pipeline run appends its timings to."""
+    sqlite_conn.execute("""
+        CREATE TABLE IF NOT EXISTS query_metrics (
+            run_id TEXT NOT NULL,
+            recorded_at TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            name TEXT NOT NULL,
+            wall_seconds REAL,
+            cpu_seconds REAL,
+            rows INTEGER,
+            source_rows INTEGER,
+            peak_memory_bytes INTEGER,
+            profile TEXT
+        )
+    """)
+    sqlite_conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_query_metrics_stage_name
+        ON query_metrics (stage, name, recorded_at)
+    """)
+    # The Performance page reads only the latest recordings
+    sqlite_conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_query_metrics_recorded_at
+        ON query_metrics (recorded_at)
+    """)
+
+
+def enable_profiling(cursor):
+    """Have DuckDB profile every statement run on this cursor, without printing anything."""
+    cursor.execute("SET enable_profiling = 'no_output'")
+
+
+def last_profile(cursor):
+    """
+    Summarize the profile of the last statement run on a profiling cursor: the
+    operator tree EXPLAIN ANALYZE would print (timing and rows per operator),
+    its CPU time and the peak memory of DuckDB's buffer manager.
+    """
+    info = json.loads(cursor.get_profiling_information(format='json'))
+    operators = []
+
+    def walk(node, depth):
+        for child in node.get('children') or []:
+            operators.append({
+                'operator': child.get('operator_name'),
+                'depth': depth,
+                'seconds': child.get('operator_timing'),
+                'rows': child.get('operator_cardinality'),
+            })
+            walk(child, depth + 1)
+
+    walk(info, 0)
+    return {
+        'cpu_seconds': info.get('cpu_time'),
+        'peak_memory_bytes': info.get('system_peak_buffer_memory'),
+        'operators': operators,
+    }
+
+
+def make_metric(stage, name, wall_seconds, rows=None, profile=None):
+    """One row of query_metrics, before the run-level columns are filled in."""
+    profile = profile or {}
+    return {
+        'stage': stage,
+        'name': name,
+        'wall_seconds': wall_seconds,
+        'cpu_seconds': profile.get('cpu_seconds'),
+        'rows': rows,
+        'peak_memory_bytes': profile.get('peak_memory_bytes'),
+        'profile': json.dumps(profile['operators']) if profile.get('operators') else None,
+    }
+
+
+def record_metrics(sqlite_conn, run_id, source_rows, metrics):
+    """
+    Append the metrics of one pipeline run to query_metrics, with a new
+    metrics_version marker that the dashboard's Performance page keys on:
+    runs that skip every report record metrics without a new data_version.
+    """
+    ensure_query_metrics(sqlite_conn)
+    recorded_at = datetime.now().isoformat(timespec='seconds')
+    sqlite_conn.executemany("""
+        INSERT INTO query_metrics (run_id, recorded_at, stage, name, wall_seconds, cpu_seconds,
+                                   rows, source_rows, peak_memory_bytes, profile)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(run_id, recorded_at, m['stage'], m['name'], m['wall_seconds'], m['cpu_seconds'],
+           m['rows'], source_rows, m['peak_memory_bytes'], m['profile']) for m in metrics])
+    set_pipeline_meta(sqlite_conn, 'metrics_version', uuid.uuid4().hex)
+    sqlite_conn.commit()
+
+
+def record_cube_source(duckdb_conn, source):
+    """Remember in the cube_meta table which CUBE_SOURCES entry divvy_cube was built from."""
+    duckdb_conn.execute("""
+        CREATE TABLE IF NOT EXISTS cube_meta (
+            key VARCHAR PRIMARY KEY,
+            value VARCHAR NOT NULL
+        )
+    """)
+    duckdb_conn.execute("INSERT OR REPLACE INTO cube_meta VALUES ('cube_source', ?)", [source])
+
+
+def built_cube_source(duckdb_conn):
+    """The CUBE_SOURCES entry divvy_cube was last built from, or None if it was not recorded."""
+    has_meta = duckdb_conn.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'cube_meta'").fetchone()[0]
+    if not has_meta:
+        return None
+    row = duckdb_conn.execute("SELECT value FROM cube_meta WHERE key = 'cube_source'").fetchone()
+    return row[0] if row else None
+
+
+def build_cube(duckdb_conn, source='wide'):
+    """
+    Scan the trips once, from one of CUBE_SOURCES, and materialize the divvy_cube
+    table every report reads from, recording the source with it. Returns its metrics.
+    """
+    start = time.perf_counter()
+    cursor = duckdb_conn.cursor()
+    try:
+        enable_profiling(cursor)
+        cursor.execute("BEGIN TRANSACTION")
+        try:
+            cursor.execute(CUBE_QUERY.format(source=CUBE_SOURCES[source]))
+            profile = last_profile(cursor)
+            record_cube_source(cursor, source)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        wall_seconds = time.perf_counter() - start
+        cube_rows = cursor.execute("SELECT COUNT(*) FROM divvy_cube").fetchone()[0]
+    finally:
+        cursor.close()
+    print(f"Built divvy_cube with {cube_rows} rows.")
+    return make_metric('cube', 'divvy_cube', wall_seconds, cube_rows, profile)
+
+
+def merge_into_cube(duckdb_conn, source):
+    """
+    Add the cube of the trips in `source` (a SELECT with the columns of
+    CUBE_SOURCES, e.g. from CUBE_BATCH_SOURCES) to divvy_cube, leaving it as
+    if it had been built from all trips at once. divvy_cube is small, so
+    this is cheap.
+    """
+    measures = [(name, column_type) for name, column_type, *_ in
+                duckdb_conn.execute("DESCRIBE divvy_cube").fetchall() if name not in CUBE_KEYS]
+    duckdb_conn.execute(f"""
+        CREATE OR REPLACE TABLE divvy_cube AS
+        SELECT {', '.join(CUBE_KEYS)},
+               {', '.join(f'CAST(SUM({name}) AS {column_type}) AS {name}' for name, column_type in measures)}
+        FROM (
+            SELECT * FROM divvy_cube
+            UNION ALL BY NAME
+            {CUBE_SELECT.format(source=source)}
+        )
+        GROUP BY ALL
+    """)
+
+
+def compute_report(duckdb_conn, name, query):
+    """
+    Build {name}_results on a dedicated DuckDB cursor so reports can run side by side.
+    Returns its metrics: wall time, rows produced, peak memory and operator profile.
+    """
+    start = time.perf_counter()
+    cursor = duckdb_conn.cursor()
+    try:
+        enable_profiling(cursor)
+        # Create initial result table
+        create_table_query = f"""
+            CREATE OR REPLACE TABLE {name}_results AS {query}
+        """
+        cursor.execute(create_table_query)
+        profile = last_profile(cursor)
+        wall_seconds = time.perf_counter() - start
+        rows = cursor.execute(f"SELECT COUNT(*) FROM {name}_results").fetchone()[0]
+        return make_metric('query', name, wall_seconds, rows, profile)
+    finally:
+        cursor.close()
+
+
+def sqlite_compatible_select(cursor, table_name):
+    """
+    SELECT every column of a DuckDB table, casting types the sqlite extension
+    would otherwise store as text (HUGEINT sums, DECIMALs) to native ones.
+    """
+    columns = []
+    for column_name, column_type, *_ in cursor.execute(f"DESCRIBE {table_name}").fetchall():
+        if column_type in ('HUGEINT', 'UHUGEINT'):
+            columns.append(f'"{column_name}"::BIGINT AS "{column_name}"')
+        elif column_type.startswith('DECIMAL'):
+            columns.append(f'"{column_name}"::DOUBLE AS "{column_name}"')
+        else:
+            columns.append(f'"{column_name}"')
+    return f"SELECT {', '.join(columns)} FROM {table_name}"
+
+
+def attach_sqlite(duckdb_conn, sqlite_db):
+    """Attach the SQLite results file to a DuckDB connection as sqlite_db, for export_report."""
+    duckdb_conn.execute("INSTALL sqlite;")
+    duckdb_conn.execute("LOAD sqlite;")
+    duckdb_conn.execute(f"ATTACH '{sqlite_db}' AS sqlite_db (TYPE SQLITE);")
+
+
+def export_report(cursor, name, profile=False):
+    """
+    Copy the full {name}_results into the attached SQLite file, with its indexes, in one transaction.
+    With profile set (on a cursor passed to enable_profiling) returns the profile of the copy.
+    """
+    copy_profile = None
+    cursor.execute("BEGIN TRANSACTION")
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS sqlite_db.{name}_results")
+        cursor.execute(f"CREATE TABLE sqlite_db.{name}_results AS "
+                       f"{sqlite_compatible_select(cursor, f'{name}_results')}")
+        if profile:
+            copy_profile = last_profile(cursor)
+        for index in RESULT_INDEXES.get(name, []):
+            columns = (index,) if isinstance(index, str) else index
+            cursor.execute(f"CREATE INDEX idx_{name}_results_{'_'.join(columns)} "
+                           f"ON sqlite_db.main.{name}_results ({', '.join(columns)})")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return copy_profile
+
+
+def run_queries(max_workers=None, force_refresh=False, preview=True, settings=None):
+    """
+    Compute every report in `queries` on a thread pool and export each one to
+    SQLite as soon as it finishes, while the remaining reports keep running.
+    Reports whose query text and source data are unchanged since their last
+    export are skipped unless force_refresh is set. File paths and DuckDB
+    settings come from `settings` (see config.py).
+    """
+    settings = settings or config.load_config()
+    sqlite_db = settings['sqlite_db']
+    if max_workers is None:
+        max_workers = min(len(queries), os.cpu_count() or 1)
+    run_id = uuid.uuid4().hex
+    metrics = []
+
+    with sqlite3.connect(sqlite_db) as sqlite_conn:
+        ensure_result_cache(sqlite_conn)
+        evict_stale_entries(sqlite_conn)
+
+        csv_file = settings['small_data_csv']
+        small_data_key = small_data_cache_key(csv_file)
+        small_data_cached = not force_refresh and is_cached(sqlite_conn, 'small_data', small_data_key)
+
+    # Open DuckDB before changing SQLite, so a run that cannot lock the file
+    # (e.g. while another process writes it) stops without touching anything
+    try:
+        duckdb_conn = duckdb.connect(settings['database'])
+    except Exception as e:
+        print(f"Error establishing database connections: {e}")
         return
+
+    # First load the CSV into SQLite
+    if small_data_cached:
+        print(f"small_data is up to date, skipping {csv_file}.")
+    else:
+        load_start = time.perf_counter()
+        if not load_csv_to_sqlite(csv_file, sqlite_db, 'small_data', index_columns=SMALL_DATA_INDEXES):
+            print("Failed to load CSV file. Aborting queries.")
+            duckdb_conn.close()
+            return
+        load_seconds = time.perf_counter() - load_start
+        with sqlite3.connect(sqlite_db) as sqlite_conn:
+            store_cache_entry(sqlite_conn, 'small_data', small_data_key)
+            bump_data_version(sqlite_conn)
+            row = sqlite_conn.execute(
+                "SELECT value FROM pipeline_meta WHERE key = 'row_count:small_data'").fetchone()
+        metrics.append(make_metric('small_data', 'small_data', load_seconds, int(row[0]) if row else None))
+    sqlite_conn = None
     try:
-        with duckdb.connect('file_db.duckdb') as duckdb_conn, \
-                sqlite3.connect('sqlite_file.sqlite') as sqlite_conn:
-
-            duckdb_conn.execute("INSTALL sqlite;")
-            duckdb_conn.execute("LOAD sqlite;")
-
-            for name, query in queries.items():
-                try:
-                    # Create initial result table
-                    create_table_query = f"""
-                        CREATE OR REPLACE TABLE {name}_results AS {query}
-                    """
-                    duckdb_conn.execute(create_table_query)
-
-                    row_count = duckdb_conn.execute(f"SELECT COUNT(*) FROM {name}_results").fetchone()[0]
-                    if row_count > 500:
-                        sample_query = f"""
-                            CREATE OR REPLACE TABLE {name}_results AS 
-                            SELECT * FROM {name}_results USING SAMPLE 500 ROWS;
-                        """
-                        duckdb_conn.execute(sample_query)
-                        print(f"Table {name} had more than 500 rows, reduced to 500.")
-
-                    # Export results
-                    result = duckdb_conn.execute(f"SELECT * FROM {name}_results").fetchdf()
-
-                    # Save to SQLite
-                    result.to_sql(f"{name}_results", sqlite_conn, if_exists='replace', index=False)
-                    print(f"Saved {name}_results table to SQLite.")
-
-                    # Display preview
-                    print(f"\nFirst 10 rows of {name}:")
-                    print(result.head(10))
-
-                except Exception as e:
-                    print(f"Error in {name}: {e}")
-                    continue
+        with duckdb_conn, sqlite3.connect(sqlite_db) as sqlite_conn:
+
+            config.apply_duckdb_settings(duckdb_conn, settings)
+            print(f"DuckDB settings: {config.describe(settings)}.")
+            attach_sqlite(duckdb_conn, sqlite_db)
+
+            run_start = time.perf_counter()
+
+            # Skip every report whose inputs have not changed since its last export
+            fingerprint = source_fingerprint(duckdb_conn)
+            source_rows = duckdb_conn.execute("SELECT COUNT(*) FROM divvy_data").fetchone()[0]
+            cube_source = settings['cube_source']
+            keys = {name: report_cache_key(name, fingerprint, cube_source) for name in queries}
+            pending = {name: query for name, query in queries.items()
+                       if force_refresh or not is_cached(sqlite_conn, name, keys[name])}
+            for name in queries:
+                if name not in pending:
+                    print(f"{name}_results is up to date, skipping.")
+            if not pending:
+                if metrics:
+                    record_metrics(sqlite_conn, run_id, source_rows, metrics)
+                print("All reports are up to date.")
+                return
+
+            # Station dimension for geographic lookups (see stations.py)
+            stations_start = time.perf_counter()
+            station_count = stations.build_station_dim(duckdb_conn)
+            metrics.append(make_metric('dimension', 'station_dim', time.perf_counter() - stations_start,
+                                       station_count))
+
+            # Narrow trip_fact table and the other dimensions (see schema.py), which
+            # duck_data_proc.py builds at ingest; only changed source files are reloaded
+            if cube_source == 'star':
+                schema_start = time.perf_counter()
+                fact_count = schema.refresh_star_schema(duckdb_conn, build_stations=False)
+                metrics.append(make_metric('dimension', 'star_schema', time.perf_counter() - schema_start,
+                                           fact_count))
+
+            # Single pass over the trips shared by all reports
+            metrics.append(build_cube(duckdb_conn, cube_source))
+
+            # Origin-destination matrices by hour and day type (see od_flows.py)
+            flows_start = time.perf_counter()
+            flow_count = od_flows.build_od_flows(duckdb_conn, settings['od_flows'])
+            metrics.append(make_metric('flows', 'od_flows', time.perf_counter() - flows_start, flow_count))
+
+            # Station network rankings (see station_graph.py), exported with the reports
+            exported = 0
+            graph_start = time.perf_counter()
+            centrality_count = station_graph.build_station_centrality(duckdb_conn)
+            graph_cursor = duckdb_conn.cursor()
+            try:
+                export_report(graph_cursor, 'station_centrality')
+            finally:
+                graph_cursor.close()
+            exported += 1
+            metrics.append(make_metric('graph', 'station_centrality', time.perf_counter() - graph_start,
+                                       centrality_count))
+
+            # Mergeable duration and distinct-station sketches per month (see sketches.py)
+            sketch_start = time.perf_counter()
+            sketch_count = sketches.build_sketches(duckdb_conn)
+            sketch_cursor = duckdb_conn.cursor()
+            try:
+                export_report(sketch_cursor, 'trip_sketch')
+                exported += 1
+            finally:
+                sketch_cursor.close()
+            metrics.append(make_metric('sketches', 'sketches', time.perf_counter() - sketch_start, sketch_count))
+
+            # Hourly trips rolled up to days, weeks, months, years and weekday x hour (see rollups.py)
+            rollup_start = time.perf_counter()
+            rollup_count = rollups.build_rollups(duckdb_conn)
+            rollup_cursor = duckdb_conn.cursor()
+            try:
+                for name in ('time_rollup', 'hour_weekday'):
+                    export_report(rollup_cursor, name)
+                    exported += 1
+            finally:
+                rollup_cursor.close()
+            metrics.append(make_metric('rollups', 'time_rollups', time.perf_counter() - rollup_start, rollup_count))
+
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = {pool.submit(compute_report, duckdb_conn, name, query): name
+                           for name, query in pending.items()}
+
+                # Export on this thread as reports complete, overlapping with the others
+                export_cursor = duckdb_conn.cursor()
+                enable_profiling(export_cursor)
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        metric = future.result()
+                        metrics.append(metric)
+
+                        # Save to SQLite straight from DuckDB
+                        export_start = time.perf_counter()
+                        copy_profile = export_report(export_cursor, name, profile=True)
+                        store_cache_entry(sqlite_conn, name, keys[name])
+                        exported += 1
+                        export_seconds = time.perf_counter() - export_start
+                        metrics.append(make_metric('export', name, export_seconds, metric['rows'], copy_profile))
+                        peak_mb = (metric['peak_memory_bytes'] or 0) / 2**20
+                        print(f"Saved {name}_results table to SQLite ({metric['rows']} rows, "
+                              f"query {metric['wall_seconds']:.2f}s, export {export_seconds:.2f}s, "
+                              f"peak memory {peak_mb:.1f} MB).")
+
+                        # Display preview
+                        if preview:
+                            print(f"\nFirst 10 rows of {name}:")
+                            print(export_cursor.execute(f"SELECT * FROM {name}_results LIMIT 10").fetchdf())
+
+                    except Exception as e:
+                        print(f"Error in {name}: {e}")
+                        continue
+
+            # Keep the timings of this run in query_metrics for the Performance page
+            run_seconds = time.perf_counter() - run_start
+            metrics.append(make_metric('run', 'total', run_seconds))
+            record_metrics(sqlite_conn, run_id, source_rows, metrics)
+            if exported:
+                bump_data_version(sqlite_conn)
+
+            print(f"\nAll reports finished in {run_seconds:.2f}s "
+                  f"using {max_workers} worker(s).")
     except Exception as e:
         print(f"Error establishing database connections: {e}")
     finally:
@@ -255,4 +898,15 @@ def run_queries():
 
 
 if __name__ == "__main__":
-    run_queries()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the analysis queries and export them to SQLite.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of reports computed concurrently (default: one per CPU core)")
+    parser.add_argument("--force", action="store_true",
+                        help="recompute and re-export every report even if its cache entry is current")
+    parser.add_argument("--no-preview", action="store_true",
+                        help="do not print the first rows of each report")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+
+    run_queries(max_workers=args.workers, force_refresh=args.force, preview=not args.no_preview,
+                settings=config.config_from_args(args))
\ No newline at end of file
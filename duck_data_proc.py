@@ -1,50 +1,345 @@
+import argparse
 import duckdb
+import glob
+import hashlib
 import logging
 import os
 
+import config
+import schema
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+CSV_PATH = r"1 Full Divvy Dataframe final.csv"
+LAKE_DIR = "divvy_lake"
+
+# Layout of the Divvy CSV, read with explicit types instead of a sniffing pass.
+# The first (unnamed) column is the pandas index of the original export.
+CSV_COLUMNS = {
+    'row_index': 'BIGINT',
+    'start_time': 'VARCHAR', 'end_time': 'VARCHAR',
+    'trip_duration': 'INTEGER',
+    'start_station_id': 'VARCHAR', 'start_station_name': 'VARCHAR',
+    'end_station_id': 'VARCHAR', 'end_station_name': 'VARCHAR',
+    'usertype': 'TINYINT', 'gender': 'TINYINT',
+    'start_lat': 'DOUBLE', 'start_lng': 'DOUBLE', 'end_lat': 'DOUBLE', 'end_lng': 'DOUBLE',
+    'rideable_type': 'TINYINT',
+    'start_city': 'TINYINT', 'start_landmark': 'SMALLINT',
+    'end_city': 'TINYINT', 'end_landmark': 'SMALLINT',
+    'start_date': 'VARCHAR', 'end_date': 'VARCHAR',
+    'start_dpcapacity': 'SMALLINT', 'end_dpcapacity': 'SMALLINT',
+    'age': 'SMALLINT',
+    'st_hour': 'TINYINT', 'st_minute': 'TINYINT', 'st_second': 'TINYINT',
+    'ed_hour': 'TINYINT', 'ed_minute': 'TINYINT', 'ed_second': 'TINYINT',
+    'st_year': 'SMALLINT', 'st_month': 'TINYINT', 'st_day': 'TINYINT',
+    'ed_year': 'SMALLINT', 'ed_month': 'TINYINT', 'ed_day': 'TINYINT',
+}
+
+# Stored columns of divvy_data. Dates and times are folded into real timestamps,
+# and station names are left to DuckDB's and Parquet's dictionary compression.
+DIVVY_COLUMNS = {
+    'start_ts': ('TIMESTAMP', "strptime(start_date || ' ' || start_time, '%d/%m/%Y %H:%M:%S')"),
+    'end_ts': ('TIMESTAMP', "strptime(end_date || ' ' || end_time, '%d/%m/%Y %H:%M:%S')"),
+    'trip_duration': ('INTEGER', 'trip_duration'),
+    'start_station_id': ('VARCHAR', 'start_station_id'),
+    'start_station_name': ('VARCHAR', 'start_station_name'),
+    'end_station_id': ('VARCHAR', 'end_station_id'),
+    'end_station_name': ('VARCHAR', 'end_station_name'),
+    'usertype': ('TINYINT', 'usertype'),
+    'gender': ('TINYINT', 'gender'),
+    'start_lat': ('DOUBLE', 'start_lat'),
+    'start_lng': ('DOUBLE', 'start_lng'),
+    'end_lat': ('DOUBLE', 'end_lat'),
+    'end_lng': ('DOUBLE', 'end_lng'),
+    'rideable_type': ('TINYINT', 'rideable_type'),
+    'start_city': ('TINYINT', 'start_city'),
+    'start_landmark': ('SMALLINT', 'start_landmark'),
+    'end_city': ('TINYINT', 'end_city'),
+    'end_landmark': ('SMALLINT', 'end_landmark'),
+    'start_dpcapacity': ('SMALLINT', 'start_dpcapacity'),
+    'end_dpcapacity': ('SMALLINT', 'end_dpcapacity'),
+    'age': ('SMALLINT', 'age'),
+}
+
+# The st_*/ed_* parts are never stored; they are computed from the timestamps
+DERIVED_COLUMNS = {
+    'st_hour': ('TINYINT', 'hour(start_ts)'),
+    'st_minute': ('TINYINT', 'minute(start_ts)'),
+    'st_second': ('TINYINT', 'second(start_ts)'),
+    'ed_hour': ('TINYINT', 'hour(end_ts)'),
+    'ed_minute': ('TINYINT', 'minute(end_ts)'),
+    'ed_second': ('TINYINT', 'second(end_ts)'),
+    'st_year': ('SMALLINT', 'year(start_ts)'),
+    'st_month': ('TINYINT', 'month(start_ts)'),
+    'st_day': ('TINYINT', 'day(start_ts)'),
+    'ed_year': ('SMALLINT', 'year(end_ts)'),
+    'ed_month': ('TINYINT', 'month(end_ts)'),
+    'ed_day': ('TINYINT', 'day(end_ts)'),
+}
+
+
+def divvy_projection(extra_columns=()):
+    """The SELECT list that turns rows with the CSV_COLUMNS layout into DIVVY_COLUMNS."""
+    projection = [f"{expr}::{sql_type} AS {name}" for name, (sql_type, expr) in DIVVY_COLUMNS.items()]
+    return ', '.join(projection + list(extra_columns))
+
+
+def typed_csv_select(csv_path, extra_columns=()):
+    """Build the SELECT that reads a Divvy CSV with explicit types and projects it onto DIVVY_COLUMNS."""
+    csv_path = csv_path.replace("'", "''")
+    columns = ', '.join(f"'{name}': '{sql_type}'" for name, sql_type in CSV_COLUMNS.items())
+    return f"""
+        SELECT {divvy_projection(extra_columns)}
+        FROM read_csv('{csv_path}', header = true, columns = {{{columns}}}, parallel = true)
+    """
+
+
+def create_divvy_table(conn):
+    """Create the typed divvy_data table, with the st_*/ed_* fields as virtual columns."""
+    columns = [f"{name} {sql_type}" for name, (sql_type, _) in DIVVY_COLUMNS.items()]
+    columns.append("source_file VARCHAR")
+    columns += [f"{name} {sql_type} GENERATED ALWAYS AS ({expr}) VIRTUAL"
+                for name, (sql_type, expr) in DERIVED_COLUMNS.items()]
+    conn.execute(f"CREATE TABLE IF NOT EXISTS divvy_data ({', '.join(columns)})")
+
+
+def table_exists(conn, table_name):
+    """Return True if a table with the given name exists in DuckDB."""
+    return conn.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [table_name]).fetchone()[0] > 0
+
 
 # Function to connect to DuckDB
-def connect_to_duckdb():
-    """Connect to DuckDB and return the connection object."""
+def connect_to_duckdb(settings=None):
+    """Connect to DuckDB with the configured settings and return the connection object."""
+    settings = settings or config.load_config()
     try:
-        conn = duckdb.connect(database='file_db.duckdb')
-        logging.info("Connected to DuckDB successfully.")
+        conn = duckdb.connect(database=settings['database'])
+        config.apply_duckdb_settings(conn, settings)
+        logging.info(f"Connected to DuckDB successfully ({config.describe(settings)}).")
         return conn
     except Exception as e:
         logging.error(f"Failed to connect to DuckDB: {e}")
         raise
 
 
+def drop_divvy_data(conn):
+    """Drop divvy_data whether it currently exists as a table or as a view."""
+    kind = conn.execute("""
+        SELECT 'TABLE' FROM duckdb_tables() WHERE table_name = 'divvy_data'
+        UNION ALL
+        SELECT 'VIEW' FROM duckdb_views() WHERE view_name = 'divvy_data'
+    """).fetchone()
+    if kind:
+        conn.execute(f"DROP {kind[0]} divvy_data")
+
+
 # Function to load data into DuckDB
-def load_data_into_duckdb(conn):
+def load_data_into_duckdb(conn, csv_path=CSV_PATH):
     """Load the CSV file into DuckDB."""
-    csv_path = r"1 Full Divvy Dataframe final.csv"
     try:
+        if table_exists(conn, 'divvy_data'):
+            logging.info("divvy_data already exists; use --mode incremental to add new files.")
+            return
+
         # Load CSV into DuckDB
-        conn.execute(f""" 
-            CREATE TABLE IF NOT EXISTS divvy_data AS 
-            SELECT * FROM read_csv_auto('{csv_path}')
-        """)
+        source_file = os.path.abspath(csv_path)
+        conn.execute("BEGIN TRANSACTION")
+        drop_divvy_data(conn)  # a view left over from lake mode
+        create_divvy_table(conn)
+        conn.execute(f"""
+            INSERT INTO divvy_data BY NAME
+            {typed_csv_select(csv_path, ["? AS source_file"])}
+        """, [source_file])
+        conn.execute("COMMIT")
+
+        # Record the file so a later incremental run does not load it twice
+        ensure_manifest(conn)
+        record_manifest_entry(conn, source_file, hash_file(source_file))
         logging.info("Data loaded into DuckDB successfully.")
     except Exception as e:
         logging.error(f"Failed to load data into DuckDB: {e}")
         raise
 
 
+# Function to convert the CSV into a partitioned Parquet lake
+def load_data_into_parquet_lake(conn, csv_path=CSV_PATH, lake_dir=LAKE_DIR):
+    """
+    Convert the CSV into Parquet files partitioned by st_year/st_month
+    and expose divvy_data as a view over them, so filters on year or
+    month only read the matching partitions. The view stores the lake's
+    absolute path, so it works from any working directory.
+    """
+    try:
+        source_file = os.path.abspath(csv_path).replace("'", "''")
+        lake_path = os.path.abspath(lake_dir).replace("'", "''")
+        partition_columns = [f"'{source_file}' AS source_file"]
+        partition_columns += [f"{DERIVED_COLUMNS[name][1]} AS {name}" for name in ('st_year', 'st_month')]
+        conn.execute(f"""
+            COPY ({typed_csv_select(csv_path, partition_columns)})
+            TO '{lake_path}' (FORMAT PARQUET, PARTITION_BY (st_year, st_month), OVERWRITE true)
+        """)
+
+        # Replace the old table (or view) with a view over the lake; st_year and
+        # st_month come from the partition paths, the other parts are derived
+        derived = [f"{expr}::{sql_type} AS {name}" for name, (sql_type, expr) in DERIVED_COLUMNS.items()
+                   if name not in ('st_year', 'st_month')]
+        drop_divvy_data(conn)
+        conn.execute(f"""
+            CREATE VIEW divvy_data AS
+            SELECT *, {', '.join(derived)}
+            FROM read_parquet('{lake_path}/**/*.parquet', hive_partitioning = true)
+        """)
+
+        # Keep the manifest in step with the lake so downstream caches see the reload
+        ensure_manifest(conn)
+        conn.execute("DELETE FROM ingest_manifest")
+        record_manifest_entry(conn, os.path.abspath(csv_path), hash_file(csv_path))
+        logging.info(f"Data converted into Parquet lake at '{lake_dir}' successfully.")
+    except Exception as e:
+        logging.error(f"Failed to build Parquet lake: {e}")
+        raise
+
+
+# Functions for incremental, manifest-driven ingestion
+def ensure_manifest(conn):
+    """Create the table that records every source file already loaded."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_manifest (
+            path VARCHAR PRIMARY KEY,
+            size BIGINT,
+            mtime DOUBLE,
+            content_hash VARCHAR,
+            row_count BIGINT,
+            loaded_at TIMESTAMP
+        )
+    """)
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return the SHA-256 of a file, read in chunks so large files stay cheap."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def record_manifest_entry(conn, path, content_hash):
+    """Upsert the manifest row for a loaded file and return its row count."""
+    stat = os.stat(path)
+    row_count = conn.execute(
+        "SELECT COUNT(*) FROM divvy_data WHERE source_file = ?", [path]).fetchone()[0]
+    conn.execute("""
+        INSERT OR REPLACE INTO ingest_manifest VALUES (?, ?, ?, ?, ?, now())
+    """, [path, stat.st_size, stat.st_mtime, content_hash, row_count])
+    return row_count
+
+
+def list_source_files(source):
+    """Return the CSV files to ingest from a single file or a directory of monthly drops."""
+    if os.path.isdir(source):
+        return sorted(os.path.abspath(p) for p in glob.glob(os.path.join(source, '*.csv')))
+    return [os.path.abspath(source)]
+
+
+def load_data_incrementally(conn, source=CSV_PATH):
+    """
+    Load only new or changed source files into divvy_data.
+    Each file's rows are tagged with source_file; a changed file has its
+    old rows replaced in the same transaction that updates the manifest.
+    Returns the number of files loaded.
+    """
+    if conn.execute("SELECT COUNT(*) FROM duckdb_views() WHERE view_name = 'divvy_data'").fetchone()[0]:
+        raise RuntimeError("divvy_data is a view over the Parquet lake; rebuild it with --mode lake "
+                           "or drop it before loading incrementally.")
+
+    ensure_manifest(conn)
+    files = list_source_files(source)
+    if not files:
+        logging.info(f"No source files found in '{source}'.")
+        return 0
+
+    table_columns = [row[0] for row in conn.execute("""
+        SELECT column_name FROM duckdb_columns() WHERE table_name = 'divvy_data'
+    """).fetchall()]
+    if not table_columns:
+        create_divvy_table(conn)
+    elif 'source_file' not in table_columns:
+        raise RuntimeError("divvy_data was created by a full load and cannot be updated "
+                           "incrementally; drop it (or file_db.duckdb) and re-run in incremental mode.")
+
+    manifest = {row[0]: row[1:] for row in conn.execute(
+        "SELECT path, size, mtime, content_hash FROM ingest_manifest").fetchall()}
+
+    loaded = 0
+    for path in files:
+        stat = os.stat(path)
+        previous = manifest.get(path)
+        if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime:
+            continue
+
+        content_hash = hash_file(path)
+        if previous and previous[2] == content_hash:
+            # Touched but not modified: remember the new mtime and move on
+            conn.execute("UPDATE ingest_manifest SET mtime = ? WHERE path = ?", [stat.st_mtime, path])
+            continue
+
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            conn.execute("DELETE FROM divvy_data WHERE source_file = ?", [path])
+            conn.execute(f"""
+                INSERT INTO divvy_data BY NAME
+                {typed_csv_select(path, ["? AS source_file"])}
+            """, [path])
+            row_count = record_manifest_entry(conn, path, content_hash)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        loaded += 1
+        logging.info(f"{'Reloaded' if previous else 'Loaded'} {path} ({row_count} rows).")
+
+    logging.info(f"Incremental load finished: {loaded} of {len(files)} files were new or changed.")
+    return loaded
+
+
 # Main function
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the Divvy CSV into DuckDB.")
+    parser.add_argument("--mode", choices=["table", "lake", "incremental"], default="table",
+                        help="'table' copies the CSV into one DuckDB table, "
+                             "'lake' writes a partitioned Parquet lake and a view over it, "
+                             "'incremental' appends only new or changed source files")
+    parser.add_argument("--source", default=None,
+                        help="CSV file to load, or a directory of CSV files in incremental mode "
+                             "(default: source_csv from the config)")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+
     try:
+        settings = config.config_from_args(args)
+        source = args.source or settings['source_csv']
+
         # Connect to DuckDB
-        conn = connect_to_duckdb()
+        conn = connect_to_duckdb(settings)
 
         # Load data into DuckDB
-        load_data_into_duckdb(conn)
+        if args.mode == "lake":
+            load_data_into_parquet_lake(conn, source, settings['lake_dir'])
+        elif args.mode == "incremental":
+            load_data_incrementally(conn, source)
+        else:
+            load_data_into_duckdb(conn, source)
+
+        # Keep the star schema in step with divvy_data when the cube is built from it
+        if settings['cube_source'] == 'star':
+            schema.refresh_star_schema(conn)
 
         # Close connection
         conn.close()
         logging.info("Data loaded into DuckDB successfully.")
     except Exception as e:
-        logging.error(f"An error occurred: {e}")
\ No newline at end of file
+        logging.error(f"An error occurred: {e}")
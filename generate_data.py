@@ -0,0 +1,216 @@
+import argparse
+import logging
+import os
+import shutil
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Column layout of Small_data.csv / "1 Full Divvy Dataframe final.csv"; the
+# first, unnamed column is the pandas index of the original export.
+COLUMNS = [
+    'start_time', 'end_time', 'trip_duration',
+    'start_station_id', 'start_station_name', 'end_station_id', 'end_station_name',
+    'usertype', 'gender', 'start_lat', 'start_lng', 'end_lat', 'end_lng',
+    'rideable_type', 'start_city', 'start_landmark', 'end_city', 'end_landmark',
+    'start_date', 'end_date', 'start_dpcapacity', 'end_dpcapacity', 'age',
+    'st_hour', 'st_minute', 'st_second', 'ed_hour', 'ed_minute', 'ed_second',
+    'st_year', 'st_month', 'st_day', 'ed_year', 'ed_month', 'ed_day',
+]
+
+YEARS = np.arange(2013, 2020)
+# Ridership grows every year; 2013 only starts in late June
+YEAR_WEIGHTS = np.array([0.04, 0.11, 0.14, 0.16, 0.17, 0.18, 0.20])
+# Strong summer peak, almost nothing in January/February
+MONTH_WEIGHTS = np.array([1.5, 1.7, 3.5, 6.0, 10.0, 13.0, 15.5, 15.0, 12.5, 9.5, 5.0, 2.5])
+# Weekday commute peaks at 8:00 and 17:00, weekends peak in the afternoon
+WEEKDAY_HOUR_WEIGHTS = np.array([
+    0.6, 0.3, 0.2, 0.1, 0.2, 0.8, 2.5, 6.0, 9.0, 5.0, 3.5, 4.0,
+    4.8, 4.8, 4.6, 5.5, 8.0, 11.0, 8.5, 5.5, 3.8, 2.8, 2.0, 1.2,
+])
+WEEKEND_HOUR_WEIGHTS = np.array([
+    1.5, 1.0, 0.7, 0.4, 0.2, 0.3, 0.6, 1.5, 3.0, 5.0, 7.0, 8.5,
+    9.0, 9.2, 9.0, 8.6, 8.0, 7.0, 5.5, 4.2, 3.2, 2.6, 2.1, 1.8,
+])
+
+# 'H:MM:SS' for every minute of the day, as in the original export
+CLOCK = np.array([f"{m // 60}:{m % 60:02d}:00" for m in range(1440)], dtype=object)
+
+
+def parse_rows(text):
+    """Parse a row count such as 500000, 1M, 10M or 100M."""
+    text = str(text).strip().upper()
+    multiplier = {'K': 1_000, 'M': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('KM')) * multiplier)
+
+
+def make_stations(rng, n_stations=600, template_csv='Small_data.csv'):
+    """
+    Build the station table: the real stations of Small_data.csv when it is
+    available, topped up with synthetic ones scattered around downtown Chicago,
+    each with a Zipf-like popularity weight.
+    """
+    real = pd.DataFrame()
+    if template_csv and os.path.exists(template_csv):
+        template = pd.read_csv(template_csv, dtype={'start_station_id': str})
+        real = template[['start_station_id', 'start_station_name', 'start_lat', 'start_lng',
+                         'start_landmark', 'start_dpcapacity']].drop_duplicates('start_station_id')
+        real.columns = ['station_id', 'station_name', 'lat', 'lng', 'landmark', 'dpcapacity']
+        real = real.head(n_stations)
+
+    missing = n_stations - len(real)
+    synthetic = pd.DataFrame({
+        'station_id': [str(1000 + i) for i in range(missing)],
+        'station_name': [f"Synthetic St & {i} Ave" for i in range(missing)],
+        'lat': rng.normal(41.89, 0.06, missing).round(6),
+        'lng': rng.normal(-87.64, 0.035, missing).round(6),
+        'landmark': rng.integers(1, 700, missing),
+        'dpcapacity': rng.integers(11, 56, missing),
+    })
+    stations = pd.concat([real, synthetic], ignore_index=True)
+
+    popularity = 1.0 / np.arange(1, len(stations) + 1) ** 0.8
+    stations['weight'] = rng.permutation(popularity) / popularity.sum()
+    return stations
+
+
+def generate_chunk(rng, stations, n_rows, first_index):
+    """Generate n_rows trips as a DataFrame in the Divvy CSV layout."""
+    # Start timestamps: year, month and hour follow the weights above
+    year = rng.choice(YEARS, n_rows, p=YEAR_WEIGHTS / YEAR_WEIGHTS.sum())
+    month = rng.choice(np.arange(1, 13), n_rows, p=MONTH_WEIGHTS / MONTH_WEIGHTS.sum())
+    month = np.where(year == 2013, np.maximum(month, 6), month)
+    month_start = (year - 1970) * 12 + (month - 1)
+    first_day = month_start.astype('datetime64[M]').astype('datetime64[D]')
+    days_in_month = ((month_start + 1).astype('datetime64[M]').astype('datetime64[D]') - first_day).astype(int)
+    date = first_day + (rng.random(n_rows) * days_in_month).astype(int)
+
+    weekend = ((date.astype(int) + 3) % 7) >= 5  # 1970-01-01 was a Thursday
+    hour = np.where(
+        weekend,
+        rng.choice(24, n_rows, p=WEEKEND_HOUR_WEIGHTS / WEEKEND_HOUR_WEIGHTS.sum()),
+        rng.choice(24, n_rows, p=WEEKDAY_HOUR_WEIGHTS / WEEKDAY_HOUR_WEIGHTS.sum()),
+    )
+    minute = rng.integers(0, 60, n_rows)
+    start = date.astype('datetime64[s]') + (hour * 3600 + minute * 60).astype('timedelta64[s]')
+
+    # Customers (usertype 0) ride longer and have no gender or age on record
+    usertype = (rng.random(n_rows) < 0.72).astype(np.int8)
+    median_minutes = np.where(usertype == 1, 11.0, 22.0)
+    duration = np.exp(rng.normal(np.log(median_minutes * 60), 0.65)).astype(np.int64)
+    duration = np.clip(duration, 60, 86_400)
+    end = start + duration.astype('timedelta64[s]')
+    end = end - (end.astype(np.int64) % 60).astype('timedelta64[s]')  # times are whole minutes
+    gender = np.where(usertype == 1, (rng.random(n_rows) < 0.24).astype(np.int8), -1)
+    age = np.where(usertype == 1, np.clip(rng.normal(34, 10, n_rows), 16, 80).astype(np.int16), -1)
+
+    # Stations: popularity-weighted, with a share of round trips
+    start_idx = rng.choice(len(stations), n_rows, p=stations['weight'].to_numpy())
+    end_idx = rng.choice(len(stations), n_rows, p=stations['weight'].to_numpy())
+    end_idx = np.where(rng.random(n_rows) < 0.08, start_idx, end_idx)
+    s = stations.iloc[start_idx].reset_index(drop=True)
+    e = stations.iloc[end_idx].reset_index(drop=True)
+
+    # Text and calendar fields come from small lookup tables indexed by minute
+    # of day and by day number, instead of formatting every row separately
+    start_s, end_s = start.astype(np.int64), end.astype(np.int64)
+    start_day, end_day = start_s // 86_400, end_s // 86_400
+    first = min(start_day.min(), end_day.min())
+    calendar = pd.DatetimeIndex(np.arange(first, max(start_day.max(), end_day.max()) + 1).astype('datetime64[D]'))
+    dates = calendar.strftime('%d/%m/%Y').to_numpy(dtype=object)
+    years, months, days = calendar.year.to_numpy(), calendar.month.to_numpy(), calendar.day.to_numpy()
+    start_minute, end_minute = (start_s // 60) % 1440, (end_s // 60) % 1440
+
+    zeros = np.zeros(n_rows, dtype=np.int8)
+    chunk = pd.DataFrame({
+        'start_time': CLOCK[start_minute],
+        'end_time': CLOCK[end_minute],
+        'trip_duration': duration,
+        'start_station_id': s['station_id'],
+        'start_station_name': s['station_name'],
+        'end_station_id': e['station_id'],
+        'end_station_name': e['station_name'],
+        'usertype': usertype,
+        'gender': gender,
+        'start_lat': s['lat'],
+        'start_lng': s['lng'],
+        'end_lat': e['lat'],
+        'end_lng': e['lng'],
+        'rideable_type': zeros,
+        'start_city': zeros,
+        'start_landmark': s['landmark'],
+        'end_city': zeros,
+        'end_landmark': e['landmark'],
+        'start_date': dates[start_day - first],
+        'end_date': dates[end_day - first],
+        'start_dpcapacity': s['dpcapacity'],
+        'end_dpcapacity': e['dpcapacity'],
+        'age': age,
+        'st_hour': start_minute // 60,
+        'st_minute': start_minute % 60,
+        'st_second': zeros,
+        'ed_hour': end_minute // 60,
+        'ed_minute': end_minute % 60,
+        'ed_second': zeros,
+        'st_year': years[start_day - first],
+        'st_month': months[start_day - first],
+        'st_day': days[start_day - first],
+        'ed_year': years[end_day - first],
+        'ed_month': months[end_day - first],
+        'ed_day': days[end_day - first],
+    }, columns=COLUMNS)
+    chunk.index = pd.RangeIndex(first_index, first_index + n_rows)
+    return chunk
+
+
+def generate_csv(output, rows, seed=42, chunk_rows=1_000_000, n_stations=600, template_csv='Small_data.csv'):
+    """
+    Write `rows` synthetic trips to `output` in the Small_data.csv layout,
+    chunk by chunk so memory stays bounded. The same seed always produces
+    the same file.
+    """
+    rng = np.random.default_rng(seed)
+    stations = make_stations(rng, n_stations, template_csv)
+    start = time.perf_counter()
+
+    # DuckDB writes each chunk (several times faster than DataFrame.to_csv)
+    # to a part file that is appended to the output under a pandas-style header
+    conn = duckdb.connect()
+    part = f"{output}.part"
+    with open(output, 'w', newline='') as f:
+        f.write(',' + ','.join(COLUMNS) + '\n')
+    written = 0
+    while written < rows:
+        n = min(chunk_rows, rows - written)
+        chunk = generate_chunk(rng, stations, n, written).reset_index()
+        conn.register('chunk', chunk)
+        conn.execute(f"COPY (SELECT * FROM chunk) TO '{part}' (FORMAT CSV, HEADER false)")
+        conn.unregister('chunk')
+        with open(output, 'ab') as out, open(part, 'rb') as src:
+            shutil.copyfileobj(src, out, 16 << 20)
+        written += n
+        logging.info(f"Wrote {written:,}/{rows:,} rows to {output}.")
+    os.remove(part)
+    conn.close()
+    logging.info(f"Generated {rows:,} rows in {time.perf_counter() - start:.1f}s.")
+    return output
+
+
+# Main function
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Divvy trips in the Small_data.csv layout.")
+    parser.add_argument("--rows", default="1M", help="number of trips, e.g. 500000, 1M, 10M, 100M")
+    parser.add_argument("--seed", type=int, default=42, help="random seed; the same seed gives the same file")
+    parser.add_argument("--output", default=None, help="CSV to write (default: synthetic_<rows>.csv)")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000, help="rows generated per chunk")
+    parser.add_argument("--stations", type=int, default=600, help="number of stations")
+    args = parser.parse_args()
+
+    n_rows = parse_rows(args.rows)
+    generate_csv(args.output or f"synthetic_{args.rows}.csv", n_rows, seed=args.seed,
+                 chunk_rows=args.chunk_rows, n_stations=args.stations)
@@ -0,0 +1,207 @@
+import os
+import threading
+from collections import OrderedDict
+
+import duckdb
+
+import config
+
+
+# Live mode for the dashboard: widget selections are turned into parameterized
+# queries against divvy_data, each run on its own short-lived read-only
+# DuckDB connection.
+class LiveQueryPool:
+    """
+    Runs at most `size` concurrent read-only queries on file_db.duckdb for
+    all dashboard sessions, with a per-query timeout and a bounded LRU cache
+    of results. Every query opens and closes its own connection, so the file
+    is only locked while a query runs and each query sees the latest data.
+    """
+
+    def __init__(self, database='file_db.duckdb', size=4, timeout=15.0, cache_size=128, settings=None):
+        self.database = database
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.settings = settings
+        self._slots = threading.BoundedSemaphore(size)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """
+        Open a read-only connection. Fails with ConnectionError, saying why, when
+        the file does not exist, a writer holds it or it cannot be opened at all.
+        """
+        if not os.path.exists(self.database):
+            raise ConnectionError(f"{self.database} does not exist; load the data with duck_data_proc.py first.")
+        try:
+            conn = duckdb.connect(self.database, read_only=True)
+        except (duckdb.IOException, duckdb.ConnectionException) as e:
+            # Another process holds the file lock, or this one has it open for writing
+            if isinstance(e, duckdb.ConnectionException) or 'Could not set lock' in str(e):
+                raise ConnectionError(f"{self.database} is being updated by a pipeline run, "
+                                      f"try again shortly. ({e})")
+            raise ConnectionError(f"Could not open {self.database}: {e}")
+        if self.settings:
+            config.apply_duckdb_settings(conn, self.settings)
+        return conn
+
+    def check(self):
+        """Open and close a connection, raising ConnectionError if live queries cannot run now."""
+        self.connect().close()
+
+    def query(self, sql, params=(), data_version=''):
+        """Run a parameterized query and return a DataFrame, from the cache when possible."""
+        key = (sql, tuple(params), data_version)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key].copy()
+
+        # Waiting for a free slot counts against the timeout too
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("All live query connections are busy, try again shortly.")
+        try:
+            conn = self.connect()
+            timer = threading.Timer(self.timeout, conn.interrupt)
+            try:
+                timer.start()
+                result = conn.execute(sql, list(params)).fetchdf()
+            except duckdb.InterruptException:
+                raise TimeoutError(f"Live query took longer than {self.timeout:.0f}s and was cancelled.")
+            finally:
+                timer.cancel()
+                conn.close()
+        finally:
+            self._slots.release()
+
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result.copy()
+
+
+AGE_GROUP_EXPR = """
+    CASE
+        WHEN age < 25 THEN 'Under 25'
+        WHEN age BETWEEN 25 AND 35 THEN '25-35'
+        WHEN age BETWEEN 36 AND 50 THEN '36-50'
+        ELSE 'Over 50'
+    END
+"""
+
+# Dimensions the live explorer can group by, mapped to their SQL expression
+GROUPINGS = {
+    'Day': "CAST(start_ts AS DATE)",
+    'Month': "date_trunc('month', start_ts)",
+    'Year': "st_year",
+    'Hour of day': "st_hour",
+    'Start station': "start_station_name",
+    'User type': "usertype",
+    'Gender': "gender",
+    'Age group': AGE_GROUP_EXPR,
+}
+
+
+def build_filters(start_date=None, end_date=None, station=None, usertype=None, gender=None):
+    """Turn the explorer's selections into a WHERE clause and its parameter list."""
+    conditions, params = [], []
+    if start_date is not None:
+        conditions.append("start_ts >= CAST(? AS TIMESTAMP)")
+        params.append(str(start_date))
+    if end_date is not None:
+        conditions.append("start_ts < CAST(? AS TIMESTAMP) + INTERVAL 1 DAY")
+        params.append(str(end_date))
+    if station is not None:
+        conditions.append("start_station_name = ?")
+        params.append(station)
+    if usertype is not None:
+        conditions.append("usertype = ?")
+        params.append(usertype)
+    if gender is not None:
+        conditions.append("gender = ?")
+        params.append(gender)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+
+def growth_rate(pool, start_year, end_year, data_version=''):
+    """The growth-rate report for an arbitrary year range, computed from divvy_data."""
+    sql = """
+        WITH yearly_totals AS (
+            SELECT st_year, COUNT(*) AS total_rides
+            FROM divvy_data
+            WHERE st_year BETWEEN ? AND ?
+            GROUP BY st_year
+        )
+        SELECT
+            st_year,
+            total_rides,
+            FIRST_VALUE(total_rides) OVER (ORDER BY st_year) AS initial_year_rides,
+            ROUND(
+                ((total_rides - FIRST_VALUE(total_rides) OVER (ORDER BY st_year)) * 100.0 /
+                FIRST_VALUE(total_rides) OVER (ORDER BY st_year)), 2
+            ) AS growth_percentage
+        FROM yearly_totals
+        ORDER BY st_year
+    """
+    return pool.query(sql, [start_year, end_year], data_version)
+
+
+def rides_by_age_group(pool, age_groups, data_version=''):
+    """Ride counts for the chosen age groups, computed from divvy_data."""
+    if not age_groups:
+        return pool.query("SELECT NULL::VARCHAR AS age_group, 0 AS total_rides LIMIT 0",
+                          data_version=data_version)
+    placeholders = ', '.join('?' for _ in age_groups)
+    sql = f"""
+        SELECT {AGE_GROUP_EXPR} AS age_group, COUNT(*) AS total_rides
+        FROM divvy_data
+        WHERE {AGE_GROUP_EXPR} IN ({placeholders})
+        GROUP BY age_group
+    """
+    return pool.query(sql, list(age_groups), data_version)
+
+
+def year_range(pool, data_version=''):
+    """Return (min, max) of st_year in divvy_data."""
+    row = pool.query("SELECT MIN(st_year) AS lo, MAX(st_year) AS hi FROM divvy_data",
+                     data_version=data_version).iloc[0]
+    return row['lo'], row['hi']
+
+
+def date_range(pool, data_version=''):
+    """Return the first and last trip start date in divvy_data."""
+    row = pool.query("""
+        SELECT CAST(MIN(start_ts) AS DATE) AS first_day, CAST(MAX(start_ts) AS DATE) AS last_day
+        FROM divvy_data
+    """, data_version=data_version).iloc[0]
+    return row['first_day'], row['last_day']
+
+
+def station_names(pool, data_version=''):
+    """All start station names, for the explorer's station picker."""
+    df = pool.query("""
+        SELECT DISTINCT start_station_name FROM divvy_data
+        WHERE start_station_name IS NOT NULL
+        ORDER BY start_station_name
+    """, data_version=data_version)
+    return df['start_station_name'].tolist()
+
+
+def slice_trips(pool, group_by, filters, limit=1000, data_version=''):
+    """Trip count and average duration per `group_by` value for the filtered trips."""
+    where, params = build_filters(**filters)
+    sql = f"""
+        SELECT
+            {GROUPINGS[group_by]} AS "{group_by}",
+            COUNT(*) AS total_trips,
+            ROUND(AVG(trip_duration / 60), 2) AS avg_duration_minutes
+        FROM divvy_data
+        {where}
+        GROUP BY 1
+        ORDER BY 1
+        LIMIT ?
+    """
+    return pool.query(sql, params + [int(limit)], data_version)
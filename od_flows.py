@@ -0,0 +1,171 @@
+import argparse
+import os
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+import config
+
+# Trips are sliced by start hour and day type: slice = st_hour for weekdays
+# and 24 + st_hour for weekends, 48 slices in all.
+N_SLICES = 48
+DAY_TYPES = {'weekday': 0, 'weekend': 1}
+
+# Trip count and mean duration per (slice, start station, end station), with
+# stations as their station_dim keys. Rows come out sorted, ready for CSR.
+OD_FLOWS_QUERY = """
+    SELECT
+        CAST(d.st_hour + 24 * (isodow(d.start_ts) >= 6)::INTEGER AS INTEGER) AS slice,
+        s.station_key AS start_key,
+        e.station_key AS end_key,
+        COUNT(*) AS trips,
+        AVG(d.trip_duration) AS mean_duration
+    FROM divvy_data d
+    JOIN station_dim s ON s.station_id = d.start_station_id
+    JOIN station_dim e ON e.station_id = d.end_station_id
+    WHERE d.start_ts IS NOT NULL
+    GROUP BY ALL
+    ORDER BY slice, start_key, end_key
+"""
+
+
+def build_od_flows(duckdb_conn, path='od_flows.npz'):
+    """
+    Aggregate divvy_data into origin-destination matrices and save them to
+    `path` as CSR arrays: row slice * n_stations + (start_key - 1) lists the
+    end stations (end_key - 1) reached from that start station in that slice.
+    station_dim must be current. Returns the number of non-zero flows.
+    """
+    n_stations = duckdb_conn.execute("SELECT COALESCE(MAX(station_key), 0) FROM station_dim").fetchone()[0]
+    flows = duckdb_conn.execute(OD_FLOWS_QUERY).fetchnumpy()
+
+    rows = flows['slice'].astype(np.int64) * n_stations + (flows['start_key'].astype(np.int64) - 1)
+    indptr = np.zeros(N_SLICES * n_stations + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=N_SLICES * n_stations), out=indptr[1:])
+
+    # Write next to the target and swap it in, so readers never see half a file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f,
+                 n_stations=np.int64(n_stations),
+                 indptr=indptr,
+                 indices=(flows['end_key'] - 1).astype(np.int32),
+                 trips=flows['trips'].astype(np.int32),
+                 mean_duration=flows['mean_duration'].astype(np.float32))
+    os.replace(tmp_path, path)
+    print(f"Saved {len(rows)} origin-destination flows for {n_stations} stations to {path}.")
+    return len(rows)
+
+
+def slices_for(hours=None, day_type=None):
+    """Slice numbers for the given start hours (default all) and day type (default both)."""
+    hours = range(24) if hours is None else hours
+    day_types = DAY_TYPES.values() if day_type is None else [DAY_TYPES[day_type]]
+    return sorted(24 * d + h for d in day_types for h in hours)
+
+
+class ODFlows:
+    """Origin-destination matrices loaded from the file build_od_flows writes."""
+
+    def __init__(self, path='od_flows.npz'):
+        with np.load(path) as data:
+            self.n_stations = int(data['n_stations'])
+            self.indptr = data['indptr']
+            self.indices = data['indices']
+            self.trips = data['trips']
+            self.mean_duration = data['mean_duration']
+
+    def _rows(self, start_keys, slices):
+        """Concatenated CSR entries of the given start stations in the given slices."""
+        rows = (np.asarray(slices)[:, None] * self.n_stations + (np.asarray(start_keys) - 1)).ravel()
+        lo, hi = self.indptr[rows], self.indptr[rows + 1]
+        counts = hi - lo
+        # Expand each [lo, hi) row slice into entry positions
+        entries = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+        start_keys = np.repeat(np.tile(np.asarray(start_keys), len(slices)), counts)
+        return start_keys, entries
+
+    def _combine(self, start_keys, end_keys, trips, durations):
+        """Sum trips and trip-weighted mean duration per (start, end) pair across slices."""
+        pair = start_keys.astype(np.int64) * (self.n_stations + 1) + end_keys
+        unique, inverse = np.unique(pair, return_inverse=True)
+        total = np.bincount(inverse, weights=trips)
+        duration = np.bincount(inverse, weights=trips * durations.astype(np.float64))
+        return pd.DataFrame({
+            'start_key': (unique // (self.n_stations + 1)).astype(np.int64),
+            'end_key': (unique % (self.n_stations + 1)).astype(np.int64),
+            'trips': total.astype(np.int64),
+            'mean_duration': duration / np.maximum(total, 1),
+        })
+
+    def flows_from(self, start_keys, hours=None, day_type=None):
+        """Every flow out of the given start stations, summed over the selected slices."""
+        start_keys = np.atleast_1d(start_keys)
+        keys, entries = self._rows(start_keys, slices_for(hours, day_type))
+        return self._combine(keys, self.indices[entries] + 1, self.trips[entries], self.mean_duration[entries])
+
+    def flows_to(self, end_keys, hours=None, day_type=None):
+        """Every flow into the given end stations, summed over the selected slices."""
+        end_keys = np.atleast_1d(end_keys)
+        n = self.n_stations
+        # All rows of one slice are a single contiguous range of entries
+        entries = np.concatenate([np.arange(self.indptr[s * n], self.indptr[(s + 1) * n])
+                                  for s in slices_for(hours, day_type)])
+        entries = entries[np.isin(self.indices[entries], end_keys - 1)]
+        rows = np.searchsorted(self.indptr, entries, 'right') - 1
+        return self._combine(rows % n + 1, self.indices[entries] + 1,
+                             self.trips[entries], self.mean_duration[entries])
+
+    def top_flows(self, station_key=None, n=10, hours=None, day_type=None, direction='out'):
+        """
+        The n largest flows by trip count: out of (or, with direction='in',
+        into) one station, or across all stations when station_key is None.
+        """
+        if station_key is None:
+            result = self.flows_from(np.arange(1, self.n_stations + 1), hours, day_type)
+        elif direction == 'in':
+            result = self.flows_to(station_key, hours, day_type)
+        else:
+            result = self.flows_from(station_key, hours, day_type)
+        return result.nlargest(n, 'trips').reset_index(drop=True)
+
+
+def with_station_names(duckdb_conn, flows):
+    """Add start and end station names to a flows DataFrame from station_dim."""
+    names = duckdb_conn.execute("SELECT station_key, station_name FROM station_dim").fetchdf()
+    names = names.set_index('station_key')['station_name']
+    flows = flows.copy()
+    flows.insert(1, 'start_station_name', flows['start_key'].map(names))
+    flows.insert(3, 'end_station_name', flows['end_key'].map(names))
+    return flows
+
+
+# Main function
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build origin-destination flow matrices and list top flows.")
+    parser.add_argument("--build", action="store_true", help="rebuild the matrices from divvy_data first")
+    parser.add_argument("--station", default=None, help="start (or with --in, end) station name")
+    parser.add_argument("--in", dest="direction", action="store_const", const="in", default="out",
+                        help="list flows into --station instead of out of it")
+    parser.add_argument("--hours", type=int, nargs="*", default=None, help="start hours to include (default: all)")
+    parser.add_argument("--day-type", choices=list(DAY_TYPES), default=None, help="weekday or weekend (default: both)")
+    parser.add_argument("--top", type=int, default=10, help="number of flows to list")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+    settings = config.config_from_args(args)
+
+    with duckdb.connect(settings['database'], read_only=not args.build) as conn:
+        config.apply_duckdb_settings(conn, settings)
+        if args.build:
+            build_od_flows(conn, settings['od_flows'])
+        station_key = None
+        if args.station:
+            row = conn.execute("SELECT station_key FROM station_dim WHERE station_name = ?",
+                               [args.station]).fetchone()
+            if row is None:
+                raise SystemExit(f"Unknown station '{args.station}'")
+            station_key = row[0]
+        flows = ODFlows(settings['od_flows'])
+        top = flows.top_flows(station_key, args.top, args.hours, args.day_type, args.direction)
+        print(with_station_names(conn, top))
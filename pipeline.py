@@ -0,0 +1,366 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import closing
+
+import config
+import data_analyzer
+import duck_data_proc
+import od_flows
+import rollups
+import schema
+import sketches
+import station_graph
+import stations
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# The whole pipeline, from the CSV to the SQLite file the dashboard reads, as
+# a DAG of stages. Stages whose dependencies are done run side by side, each
+# on its own DuckDB cursor. Every stage that finishes is checkpointed in the
+# pipeline_checkpoints table of the DuckDB file, so a run that crashes resumes
+# after its last finished stages. Exports never touch the live SQLite file:
+# they go to a staging copy, which the publish stage moves over it with one
+# os.replace once every other stage has succeeded.
+
+
+class Stage:
+    """A step of the pipeline: the function it runs and the stages that must finish first."""
+
+    def __init__(self, name, run, depends_on=()):
+        self.name = name
+        self.run = run
+        self.depends_on = list(depends_on)
+
+
+class PipelineRun:
+    """State shared by the stages of one run, and the results of its finished stages."""
+
+    def __init__(self, conn, settings, run_id, ingest_mode='table', force=False):
+        self.conn = conn
+        self.settings = settings
+        self.run_id = run_id
+        self.ingest_mode = ingest_mode
+        self.force = force
+        self.sqlite_db = settings['sqlite_db']
+        self.staging_db = settings['sqlite_db'] + '.staging'
+        self.results = {}
+        # One writer at a time on the staging file, whether DuckDB or sqlite3
+        self.sqlite_lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def report_pending(self, name):
+        return name in self.results['prepare']['pending']
+
+    def up_to_date(self):
+        """True when prepare found every report current, so the analysis stages have nothing to do."""
+        return not self.results['prepare']['pending']
+
+    def export(self, cursor, names):
+        with self.sqlite_lock:
+            for name in names:
+                data_analyzer.export_report(cursor, name)
+        return len(names)
+
+
+def ensure_checkpoints(conn):
+    """Create the table recording which stages of the current run have finished."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+            run_id VARCHAR,
+            stage VARCHAR,
+            finished_at TIMESTAMP,
+            result VARCHAR
+        )
+    """)
+
+
+def load_checkpoints(conn):
+    """Return (run_id, {stage: result}) of the unfinished run, or (None, {}) if there is none."""
+    rows = conn.execute("SELECT run_id, stage, result FROM pipeline_checkpoints ORDER BY finished_at").fetchall()
+    if not rows:
+        return None, {}
+    return rows[0][0], {stage: json.loads(result) for _, stage, result in rows}
+
+
+def save_checkpoint(cursor, run_id, stage, result):
+    cursor.execute("INSERT INTO pipeline_checkpoints VALUES (?, ?, now(), ?)", [run_id, stage, json.dumps(result)])
+
+
+def clear_checkpoints(conn):
+    conn.execute("DELETE FROM pipeline_checkpoints")
+
+
+def copy_sqlite(source, target):
+    """Copy a SQLite file with the backup API, so a reader of `source` never sees a torn copy."""
+    if os.path.exists(target):
+        os.remove(target)
+    with closing(sqlite3.connect(target)) as target_conn:
+        if os.path.exists(source):
+            with closing(sqlite3.connect(source)) as source_conn:
+                source_conn.backup(target_conn)
+
+
+# Stage functions. Each one gets the PipelineRun and a DuckDB cursor of its
+# own and returns a JSON-able result: 'rows' produced, 'exported' tables and
+# any extra 'metrics', plus whatever later stages need to know.
+def ingest(run, cursor):
+    """Load the source CSV into divvy_data as duck_data_proc.py would (mode 'none' skips it)."""
+    source = run.settings['source_csv']
+    if run.ingest_mode == 'lake':
+        duck_data_proc.load_data_into_parquet_lake(cursor, source, run.settings['lake_dir'])
+    elif run.ingest_mode == 'incremental':
+        duck_data_proc.load_data_incrementally(cursor, source)
+    elif run.ingest_mode == 'table':
+        duck_data_proc.load_data_into_duckdb(cursor, source)
+    return {'rows': cursor.execute("SELECT COUNT(*) FROM divvy_data").fetchone()[0]}
+
+
+def prepare(run, cursor):
+    """
+    Copy the live SQLite file to the staging file, drop stale cache entries
+    from the copy and work out which reports have to be rebuilt.
+    """
+    fingerprint = data_analyzer.source_fingerprint(cursor)
+    cube_source = run.settings['cube_source']
+    copy_sqlite(run.sqlite_db, run.staging_db)
+    with closing(sqlite3.connect(run.staging_db)) as sqlite_conn:
+        data_analyzer.ensure_result_cache(sqlite_conn)
+        data_analyzer.evict_stale_entries(sqlite_conn)
+        pending = [name for name in data_analyzer.queries if run.force or not data_analyzer.is_cached(
+            sqlite_conn, name, data_analyzer.report_cache_key(name, fingerprint, cube_source))]
+    for name in data_analyzer.queries:
+        if name not in pending:
+            logging.info(f"{name}_results is up to date, skipping.")
+    data_analyzer.attach_sqlite(run.conn, run.staging_db)
+    return {'fingerprint': fingerprint, 'pending': pending}
+
+
+def small_data(run, cursor):
+    """Load Small_data.csv into the staging file unless it is unchanged."""
+    csv_file = run.settings['small_data_csv']
+    key = data_analyzer.small_data_cache_key(csv_file)
+    with run.sqlite_lock:
+        with closing(sqlite3.connect(run.staging_db)) as sqlite_conn:
+            if not run.force and data_analyzer.is_cached(sqlite_conn, 'small_data', key):
+                logging.info(f"small_data is up to date, skipping {csv_file}.")
+                return {'rows': None, 'exported': 0}
+        if not data_analyzer.load_csv_to_sqlite(csv_file, run.staging_db, 'small_data',
+                                                index_columns=data_analyzer.SMALL_DATA_INDEXES):
+            raise RuntimeError(f"Failed to load {csv_file} into SQLite.")
+        with closing(sqlite3.connect(run.staging_db)) as sqlite_conn:
+            data_analyzer.store_cache_entry(sqlite_conn, 'small_data', key)
+            row = sqlite_conn.execute(
+                "SELECT value FROM pipeline_meta WHERE key = 'row_count:small_data'").fetchone()
+    return {'rows': int(row[0]) if row else None, 'exported': 1}
+
+
+def station_dim(run, cursor):
+    if run.up_to_date():
+        return {'rows': None}
+    return {'rows': stations.build_station_dim(cursor)}
+
+
+def star_schema(run, cursor):
+    """Bring the star schema up to date when the cube is built from it."""
+    if run.up_to_date() or run.settings['cube_source'] != 'star':
+        return {'rows': None}
+    return {'rows': schema.refresh_star_schema(cursor, build_stations=False)}
+
+
+def cube(run, cursor):
+    if run.up_to_date():
+        return {'rows': None}
+    metric = data_analyzer.build_cube(cursor, run.settings['cube_source'])
+    return {'rows': metric['rows'], 'metrics': [metric]}
+
+
+def flows(run, cursor):
+    if run.up_to_date():
+        return {'rows': None}
+    return {'rows': od_flows.build_od_flows(cursor, run.settings['od_flows'])}
+
+
+def graph(run, cursor):
+    if run.up_to_date():
+        return {'rows': None, 'exported': 0}
+    rows = station_graph.build_station_centrality(cursor)
+    return {'rows': rows, 'exported': run.export(cursor, ['station_centrality'])}
+
+
+def sketch(run, cursor):
+    if run.up_to_date():
+        return {'rows': None, 'exported': 0}
+    rows = sketches.build_sketches(cursor)
+    return {'rows': rows, 'exported': run.export(cursor, ['trip_sketch'])}
+
+
+def rollup(run, cursor):
+    if run.up_to_date():
+        return {'rows': None, 'exported': 0}
+    rows = rollups.build_rollups(cursor)
+    return {'rows': rows, 'exported': run.export(cursor, ['time_rollup', 'hour_weekday'])}
+
+
+def report_stage(name):
+    """Stage function computing one report from divvy_cube and exporting it, unless it is cached."""
+    def report(run, cursor):
+        if not run.report_pending(name):
+            return {'rows': None, 'exported': 0}
+        metric = data_analyzer.compute_report(cursor, name, data_analyzer.queries[name])
+        key = data_analyzer.report_cache_key(name, run.results['prepare']['fingerprint'],
+                                             run.settings['cube_source'])
+        with run.sqlite_lock:
+            data_analyzer.export_report(cursor, name)
+            with closing(sqlite3.connect(run.staging_db)) as sqlite_conn:
+                data_analyzer.store_cache_entry(sqlite_conn, name, key)
+        return {'rows': metric['rows'], 'exported': 1, 'metrics': [metric]}
+    return report
+
+
+def publish(run, cursor):
+    """
+    Record the run's metrics in the staging file, then swap it in for the
+    live SQLite file in one step: readers see either every old table or
+    every new one.
+    """
+    exported = sum(result.get('exported', 0) for result in run.results.values())
+    metrics = [metric for result in run.results.values() for metric in result.get('metrics', [])]
+    metrics += [data_analyzer.make_metric('pipeline', stage, result['seconds'], result.get('rows'))
+                for stage, result in run.results.items()]
+    metrics.append(data_analyzer.make_metric('run', 'total', time.perf_counter() - run.start))
+    source_rows = run.results['ingest']['rows']
+
+    run.conn.execute("DETACH DATABASE IF EXISTS sqlite_db")
+    with closing(sqlite3.connect(run.staging_db)) as sqlite_conn:
+        data_analyzer.record_metrics(sqlite_conn, run.run_id, source_rows, metrics)
+        if exported:
+            data_analyzer.bump_data_version(sqlite_conn)
+    os.replace(run.staging_db, run.sqlite_db)
+    logging.info(f"Published {run.sqlite_db} ({exported} tables exported).")
+    return {'rows': None, 'exported': 0}
+
+
+def build_stages():
+    """Every Stage of the pipeline, in an order where each one follows its dependencies."""
+    analysis = ['ingest', 'prepare']
+    stages = [
+        Stage('ingest', ingest),
+        Stage('prepare', prepare, ['ingest']),
+        Stage('small_data', small_data, ['prepare']),
+        Stage('station_dim', station_dim, analysis),
+        Stage('star_schema', star_schema, ['station_dim']),
+        Stage('cube', cube, ['star_schema']),
+        Stage('od_flows', flows, ['station_dim']),
+        Stage('station_graph', graph, ['station_dim']),
+        Stage('sketches', sketch, analysis),
+        Stage('rollups', rollup, analysis),
+    ]
+    stages += [Stage(f'report:{name}', report_stage(name), ['cube']) for name in data_analyzer.queries]
+    stages.append(Stage('publish', publish, [stage.name for stage in stages]))
+    return stages
+
+
+def run_stage(run, stage):
+    """Run one stage on its own cursor and checkpoint it. Returns its result."""
+    start = time.perf_counter()
+    with run.conn.cursor() as cursor:
+        result = stage.run(run, cursor)
+        result['seconds'] = time.perf_counter() - start
+        if stage.name != 'publish':
+            save_checkpoint(cursor, run.run_id, stage.name, result)
+    logging.info(f"Stage {stage.name} finished in {result['seconds']:.2f}s.")
+    return result
+
+
+def run_pipeline(settings=None, max_workers=None, ingest_mode='table', force=False, restart=False):
+    """
+    Run every stage whose dependencies are done, up to max_workers at a time,
+    resuming the last run if it did not finish (unless restart is set). A
+    failed stage stops the run before publish, leaving the live SQLite file
+    untouched; run again to retry from the failed stage. Returns True if the
+    run was published.
+    """
+    settings = settings or config.load_config()
+    stages = build_stages()
+    max_workers = max_workers or os.cpu_count() or 1
+    conn = duck_data_proc.connect_to_duckdb(settings)
+    try:
+        ensure_checkpoints(conn)
+        run_id, done = load_checkpoints(conn)
+        staging_db = settings['sqlite_db'] + '.staging'
+        if restart or (run_id and 'prepare' in done and not os.path.exists(staging_db)):
+            # Without its staging file the earlier run's exports are gone: start over
+            clear_checkpoints(conn)
+            run_id, done = None, {}
+        if run_id:
+            logging.info(f"Resuming run {run_id}; already done: {', '.join(done)}.")
+        run = PipelineRun(conn, settings, run_id or uuid.uuid4().hex, ingest_mode, force)
+        run.results.update(done)
+        if 'prepare' in done:
+            data_analyzer.attach_sqlite(conn, run.staging_db)
+
+        remaining = {stage.name: stage for stage in stages if stage.name not in done}
+        failed = []
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            running = {}
+            while remaining or running:
+                if not failed:
+                    for name, stage in list(remaining.items()):
+                        if all(dep in run.results for dep in stage.depends_on):
+                            running[pool.submit(run_stage, run, stage)] = name
+                            del remaining[name]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        run.results[name] = future.result()
+                    except Exception as e:
+                        logging.error(f"Stage {name} failed: {e}")
+                        failed.append(name)
+
+        if failed:
+            logging.error(f"Pipeline stopped after {', '.join(failed)} failed; {run.sqlite_db} was not changed. "
+                          f"Run it again to resume.")
+            return False
+        clear_checkpoints(conn)
+        logging.info(f"Pipeline finished in {time.perf_counter() - run.start:.2f}s "
+                     f"using up to {max_workers} worker(s).")
+        return True
+    finally:
+        conn.close()
+
+
+# Main function
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest, analyze and export in one run, resuming after a crash.")
+    parser.add_argument("--ingest", choices=["table", "lake", "incremental", "none"], default="table",
+                        help="how to load source_csv into DuckDB, as in duck_data_proc.py --mode "
+                             "('none' uses divvy_data as it is)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of stages run concurrently (default: one per CPU core)")
+    parser.add_argument("--force", action="store_true",
+                        help="recompute and re-export every report even if its cache entry is current")
+    parser.add_argument("--restart", action="store_true",
+                        help="discard the checkpoints of an unfinished run and start from the beginning")
+    parser.add_argument("--list", action="store_true", help="print the stages and their dependencies")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+
+    if args.list:
+        for stage in build_stages():
+            print(f"{stage.name}: {', '.join(stage.depends_on) or '-'}")
+        raise SystemExit(0)
+
+    settings = config.config_from_args(args)
+    ok = run_pipeline(settings, args.workers, args.ingest, args.force, args.restart)
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,258 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+
+# Read helpers the dashboard uses to pull sorted, filtered pages out of the
+# exported result tables instead of loading whole tables with SELECT *.
+def table_columns(conn, table_name):
+    """Return the column names of a SQLite table (empty if it does not exist)."""
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()]
+
+
+def _check_column(columns, column, table_name):
+    if column not in columns:
+        raise ValueError(f"Unknown column '{column}' in table '{table_name}'")
+    return f'"{column}"'
+
+
+# Operators accepted in (column, operator, value) filters
+OPERATORS = {'=': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=', 'contains': 'LIKE'}
+
+
+def build_where(known, table_name, filters):
+    """
+    Build a WHERE clause and its parameters from filters, either a dict that
+    maps a column to a value (=), a list of values (IN) or a (low, high)
+    tuple (BETWEEN), or a list of (column, operator, value) triples.
+    Column names are checked against the table so only values are bound.
+    """
+    conditions, params = [], []
+    items = filters.items() if isinstance(filters, dict) else filters or []
+    for item in items:
+        if isinstance(filters, dict):
+            column, value = item
+            operator = 'between' if isinstance(value, tuple) else 'in' if isinstance(value, list) else '='
+        else:
+            column, operator, value = item
+        quoted = _check_column(known, column, table_name)
+
+        if operator == 'between':
+            conditions.append(f"{quoted} BETWEEN ? AND ?")
+            params += list(value)
+        elif operator == 'in':
+            if not value:
+                conditions.append("0")  # nothing selected: no rows
+            else:
+                conditions.append(f"{quoted} IN ({', '.join('?' for _ in value)})")
+                params += value
+        elif operator == 'contains':
+            conditions.append(f"{quoted} LIKE ?")
+            params.append(f"%{value}%")
+        elif operator in OPERATORS:
+            conditions.append(f"{quoted} {OPERATORS[operator]} ?")
+            params.append(value)
+        else:
+            raise ValueError(f"Unknown filter operator '{operator}'")
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, params
+
+
+def fetch_page(conn, table_name, columns=None, filters=None, order_by=None,
+               descending=False, limit=None, offset=0):
+    """
+    Run a SELECT against one result table and return it as a DataFrame.
+    See build_where for the accepted filters.
+    """
+    known = table_columns(conn, table_name)
+    if not known:
+        raise ValueError(f"Table '{table_name}' does not exist")
+
+    select = ', '.join(_check_column(known, c, table_name) for c in columns) if columns else '*'
+    where, params = build_where(known, table_name, filters)
+    sql = f'SELECT {select} FROM "{table_name}"{where}'
+
+    if order_by:
+        sql += f" ORDER BY {_check_column(known, order_by, table_name)} {'DESC' if descending else 'ASC'}"
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [int(limit), int(offset)]
+
+    import pandas as pd  # only when a page is actually read, so importing this module stays cheap
+
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+def fetch_latest(conn, table_name, column, n):
+    """
+    Return the rows holding the n largest distinct values of `column`, e.g.
+    the last n recordings of a history table, in ascending order of it.
+    """
+    known = table_columns(conn, table_name)
+    if not known:
+        raise ValueError(f"Table '{table_name}' does not exist")
+    quoted = _check_column(known, column, table_name)
+    sql = f"""
+        SELECT * FROM "{table_name}"
+        WHERE {quoted} >= (SELECT MIN({quoted}) FROM (
+            SELECT DISTINCT {quoted} FROM "{table_name}" ORDER BY {quoted} DESC LIMIT ?))
+        ORDER BY {quoted}
+    """
+
+    import pandas as pd
+
+    return pd.read_sql_query(sql, conn, params=[int(n)])
+
+
+def fetch_keyset_page(conn, table_name, columns=None, filters=None, sort_column=None,
+                      descending=False, after=None, page_size=100):
+    """
+    Return one page of a table ordered by (sort_column, rowid), starting right
+    after the row whose key is `after`, together with the key of its last row
+    (None on the last page). Seeking on the key instead of using OFFSET keeps
+    every page as cheap as the first, and only the page is ever loaded.
+    Rows with a NULL sort_column value are left out when sorting by a column.
+    """
+    known = table_columns(conn, table_name)
+    if not known:
+        raise ValueError(f"Table '{table_name}' does not exist")
+
+    select = ', '.join(_check_column(known, c, table_name) for c in columns) if columns else '*'
+    where, params = build_where(known, table_name, filters)
+    direction, compare = ('DESC', '<') if descending else ('ASC', '>')
+
+    if sort_column:
+        sort = _check_column(known, sort_column, table_name)
+        key_columns = f"{sort} AS _sort_key, rowid AS _row_key"
+        conditions = [f"{sort} IS NOT NULL"]
+        if after is not None:
+            conditions.append(f"({sort}, rowid) {compare} (?, ?)")
+            params += list(after)
+        order = f"{sort} {direction}, rowid {direction}"
+    else:
+        key_columns = "rowid AS _row_key"
+        conditions = []
+        if after is not None:
+            conditions.append(f"rowid {compare} ?")
+            params += list(after)
+        order = f"rowid {direction}"
+
+    if conditions:
+        where += (" AND " if where else " WHERE ") + " AND ".join(conditions)
+    sql = f'SELECT {select}, {key_columns} FROM "{table_name}"{where} ORDER BY {order} LIMIT ?'
+    params.append(int(page_size) + 1)  # one extra row tells us whether a next page exists
+
+    import pandas as pd
+
+    page = pd.read_sql_query(sql, conn, params=params)
+    has_next = len(page) > page_size
+    page = page.head(page_size)
+
+    last_key = None
+    if has_next:
+        last = page.iloc[-1]
+        last_key = (last['_sort_key'], int(last['_row_key'])) if sort_column else (int(last['_row_key']),)
+        if hasattr(last_key[0], 'item'):
+            last_key = (last_key[0].item(),) + last_key[1:]
+    return page.drop(columns=[c for c in ('_sort_key', '_row_key') if c in page.columns]), last_key
+
+
+def row_count(conn, table_name, filters=None):
+    """
+    Number of rows in a table. Unfiltered counts come from the row_count
+    metadata written at load time; filtered ones (or tables without metadata)
+    fall back to COUNT(*).
+    """
+    known = table_columns(conn, table_name)
+    if not filters:
+        try:
+            row = conn.execute("SELECT value FROM pipeline_meta WHERE key = ?",
+                               (f"row_count:{table_name}",)).fetchone()
+            if row:
+                return int(row[0])
+        except sqlite3.OperationalError:
+            pass  # no pipeline_meta table yet
+    where, params = build_where(known, table_name, filters)
+    return conn.execute(f'SELECT COUNT(*) FROM "{table_name}"{where}', params).fetchone()[0]
+
+
+def column_types(conn, table_name):
+    """Map each column of a SQLite table to its declared type."""
+    return {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()}
+
+
+def top_n(conn, table_name, order_by, n=10):
+    """Return the n rows with the largest value in order_by."""
+    return fetch_page(conn, table_name, order_by=order_by, descending=True, limit=n)
+
+
+def column_range(conn, table_name, column):
+    """Return (min, max) of a column, served from its index when it has one."""
+    quoted = _check_column(table_columns(conn, table_name), column, table_name)
+    return conn.execute(f'SELECT MIN({quoted}), MAX({quoted}) FROM "{table_name}"').fetchone()
+
+
+def distinct_values(conn, table_name, column, filters=None):
+    """Return the distinct values of a column (among rows matching filters) in ascending order."""
+    known = table_columns(conn, table_name)
+    quoted = _check_column(known, column, table_name)
+    where, params = build_where(known, table_name, filters)
+    rows = conn.execute(f'SELECT DISTINCT {quoted} FROM "{table_name}"{where} ORDER BY {quoted}',
+                        params).fetchall()
+    return [row[0] for row in rows]
+
+
+class ConnectionPool:
+    """
+    Read-only connections to a SQLite results file, reused by every thread of
+    the process. Each block of reads takes an idle connection, or opens one if
+    none is idle, so sessions read side by side; at most `size` are kept idle.
+    pipeline.py publishes a new file by replacing the old one, so connections
+    to a file the path no longer points at are closed instead of reused.
+    """
+
+    def __init__(self, path, size=4):
+        self.path = path
+        self.size = size
+        self._idle = []  # (file id, connection)
+        self._lock = threading.Lock()
+
+    def _current_file_id(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_dev, stat.st_ino)
+
+    @contextmanager
+    def connect(self):
+        """Hold a connection for a block of reads: `with pool.connect() as conn: ...`."""
+        file_id = self._current_file_id()
+        conn = None
+        with self._lock:
+            while self._idle and conn is None:
+                idle_id, idle_conn = self._idle.pop()
+                if idle_id == file_id:
+                    conn = idle_conn
+                else:
+                    idle_conn.close()
+        if conn is None:
+            uri = f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                keep = len(self._idle) < self.size and file_id == self._current_file_id()
+                if keep:
+                    self._idle.append((file_id, conn))
+            if not keep:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _, conn in idle:
+            conn.close()
@@ -0,0 +1,100 @@
+import argparse
+
+import duckdb
+
+import config
+
+# Trips per clock hour, built once from the trip start timestamps. Every other
+# time grain, and the hour-by-weekday matrix, is rolled up from this table
+# rather than from divvy_data, so it reads a few thousand rows per year.
+HOURLY_QUERY = """
+    CREATE OR REPLACE TABLE hourly_rollup AS
+    SELECT
+        date_trunc('hour', start_ts) AS period_start,
+        COUNT(*) AS trips,
+        COUNT(trip_duration) AS duration_count,
+        SUM(trip_duration) AS duration_sum
+    FROM divvy_data
+    WHERE start_ts IS NOT NULL
+    GROUP BY ALL
+    ORDER BY period_start
+"""
+
+# Coarser grains and how an hour maps onto them (weeks start on Monday)
+ROLLUP_GRAINS = {
+    'day': "date_trunc('day', period_start)",
+    'week': "date_trunc('week', period_start)",
+    'month': "date_trunc('month', period_start)",
+    'year': "date_trunc('year', period_start)",
+}
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def rollup_query():
+    """SELECT of every grain, the hourly one included, with the same columns."""
+    selects = ["""
+        SELECT 'hour' AS grain, period_start, trips, duration_count, duration_sum
+        FROM hourly_rollup
+    """]
+    selects += [f"""
+        SELECT '{grain}' AS grain, {expr} AS period_start,
+               SUM(trips) AS trips, SUM(duration_count) AS duration_count, SUM(duration_sum) AS duration_sum
+        FROM hourly_rollup
+        GROUP BY ALL
+    """ for grain, expr in ROLLUP_GRAINS.items()]
+    return ' UNION ALL '.join(selects)
+
+
+def build_rollups(duckdb_conn):
+    """
+    Build hourly_rollup from divvy_data, then time_rollup_results (trips and
+    mean duration per hour, day, week, month and year) and hour_weekday_results
+    (the same per day of week and hour of day) from it. Returns the total
+    number of rows in the two result tables.
+    """
+    duckdb_conn.execute(HOURLY_QUERY)
+    duckdb_conn.execute(f"""
+        CREATE OR REPLACE TABLE time_rollup_results AS
+        SELECT
+            grain,
+            period_start,
+            CAST(trips AS BIGINT) AS trips,
+            ROUND(duration_sum / NULLIF(duration_count, 0), 2) AS mean_duration
+        FROM ({rollup_query()})
+        ORDER BY grain, period_start
+    """)
+    weekday_names = ', '.join(f"'{name}'" for name in WEEKDAYS)
+    duckdb_conn.execute(f"""
+        CREATE OR REPLACE TABLE hour_weekday_results AS
+        SELECT
+            CAST(isodow(period_start) AS TINYINT) AS weekday,
+            [{weekday_names}][isodow(period_start)] AS weekday_name,
+            CAST(hour(period_start) AS TINYINT) AS hour,
+            CAST(SUM(trips) AS BIGINT) AS trips,
+            ROUND(SUM(duration_sum) / NULLIF(SUM(duration_count), 0), 2) AS mean_duration
+        FROM hourly_rollup
+        GROUP BY ALL
+        ORDER BY weekday, hour
+    """)
+    hours = duckdb_conn.execute("SELECT COUNT(*) FROM hourly_rollup").fetchone()[0]
+    rows = duckdb_conn.execute("""
+        SELECT (SELECT COUNT(*) FROM time_rollup_results) + (SELECT COUNT(*) FROM hour_weekday_results)
+    """).fetchone()[0]
+    print(f"Built time rollups from {hours} hourly rows.")
+    return rows
+
+
+# Main function
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the time rollups and print the hour-by-weekday matrix.")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+    settings = config.config_from_args(args)
+
+    with duckdb.connect(settings['database']) as conn:
+        config.apply_duckdb_settings(conn, settings)
+        build_rollups(conn)
+        matrix = conn.execute("SELECT weekday_name, hour, trips FROM hour_weekday_results").fetchdf()
+    print(matrix.pivot(index='weekday_name', columns='hour', values='trips')
+          .reindex([day for day in WEEKDAYS if day in set(matrix['weekday_name'])]).fillna(0).astype(int))
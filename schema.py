@@ -1,19 +1,42 @@
+import argparse
+
+import duckdb
+
+import config
+import stations
+
+
 class Node:
-    def __init__(self, label, properties):
+    def __init__(self, label, properties, table=None, key=None, sources=None, key_source=None):
         self.label = label
         self.properties = properties
+        # Where the node is stored: its table, its integer key column, each
+        # property's (SQL type, expression over divvy_data), and optionally an
+        # expression that computes the key itself from divvy_data
+        self.table = table
+        self.key = key
+        self.sources = sources or {}
+        self.key_source = key_source
 
 class Relationship:
-    def __init__(self, start_node, end_node, type):
+    def __init__(self, start_node, end_node, type, foreign_key=None):
         self.start_node = start_node
         self.end_node = end_node
         self.type = type
+        # Column of the start node's table holding the end node's key
+        self.foreign_key = foreign_key
 
 trip_node = Node("Trip", [
     "trip_duration",
     "rideable_type"
-])
+], table="trip_fact", sources={
+    "trip_duration": ("INTEGER", "trip_duration"),
+    "rideable_type": ("TINYINT", "rideable_type"),
+    # The file each trip was loaded from, so trip_fact can be refreshed file by file
+    "source_file": ("VARCHAR", "source_file"),
+})
 
+# Built from both ends of every trip by stations.py
 station_node = Node("Station", [
     "station_id",
     "station_name",
@@ -22,32 +45,319 @@ station_node = Node("Station", [
     "city",
     "landmark",
     "dpcapacity"
-])
+], table="station_dim", key="station_key")
 
 rider_node = Node("Rider", [
     "usertype",
     "gender",
     "age"
-])
+], table="rider_dim", key="rider_key", sources={
+    "usertype": ("TINYINT", "usertype"),
+    "gender": ("TINYINT", "gender"),
+    "age": ("SMALLINT", "age"),
+})
 
+# One row per clock hour that trips start in, keyed by the Unix timestamp of
+# the start of the hour (a few thousand rows per year)
 time_node = Node("Time", [
     "year",
     "month",
     "day",
-    "hour",
-    "minute",
-    "second"
-])
-
-starts_at = Relationship(trip_node, station_node, "STARTS_AT")
-ends_at = Relationship(trip_node, station_node, "ENDS_AT")
-taken_by = Relationship(trip_node, rider_node, "TAKEN_BY")
-occurs_on = Relationship(trip_node, time_node, "OCCURS_ON")
-
-print("Nodes:")
-for node in [trip_node, station_node, rider_node, time_node]:
-    print(f" {node.label}: {', '.join(node.properties)}")
-
-print("\nRelationships:")
-for rel in [starts_at, ends_at, taken_by, occurs_on]:
-    print(f" ({rel.start_node.label})-[{rel.type}]->({rel.end_node.label})")
\ No newline at end of file
+    "hour"
+], table="time_dim", key="time_key", sources={
+    "year": ("SMALLINT", "year(start_ts)"),
+    "month": ("TINYINT", "month(start_ts)"),
+    "day": ("TINYINT", "day(start_ts)"),
+    "hour": ("TINYINT", "hour(start_ts)"),
+}, key_source="CAST(epoch(date_trunc('hour', start_ts)) AS BIGINT)")
+
+starts_at = Relationship(trip_node, station_node, "STARTS_AT", foreign_key="start_station_key")
+ends_at = Relationship(trip_node, station_node, "ENDS_AT", foreign_key="end_station_key")
+taken_by = Relationship(trip_node, rider_node, "TAKEN_BY", foreign_key="rider_key")
+occurs_on = Relationship(trip_node, time_node, "OCCURS_ON", foreign_key="start_time_key")
+
+NODES = [trip_node, station_node, rider_node, time_node]
+RELATIONSHIPS = [starts_at, ends_at, taken_by, occurs_on]
+
+# How each relationship finds its end node for a divvy_data row: the
+# divvy_data expression matched against each end-node property
+RELATIONSHIP_MATCHES = {
+    "STARTS_AT": {"station_id": "start_station_id"},
+    "ENDS_AT": {"station_id": "end_station_id"},
+    "TAKEN_BY": {"usertype": "usertype", "gender": "gender", "age": "age"},
+}
+
+
+def dimension_query(node):
+    """CREATE TABLE ... AS for a dimension node, one row per distinct combination of its properties."""
+    columns = [f"CAST({expr} AS {sql_type}) AS {name}" for name, (sql_type, expr) in node.sources.items()]
+    if node.key_source:
+        return f"""
+            CREATE OR REPLACE TABLE {node.table} AS
+            SELECT DISTINCT {node.key_source} AS {node.key}, {', '.join(columns)}
+            FROM divvy_data
+            WHERE {node.key_source} IS NOT NULL
+            ORDER BY {node.key}
+        """
+    return f"""
+        CREATE OR REPLACE TABLE {node.table} AS
+        SELECT CAST(ROW_NUMBER() OVER (ORDER BY {', '.join(node.sources)}) AS INTEGER) AS {node.key}, *
+        FROM (SELECT DISTINCT {', '.join(columns)} FROM divvy_data)
+        ORDER BY {node.key}
+    """
+
+
+def extend_dimension_query(node, where):
+    """INSERT into a dimension node's table the combinations of divvy_data rows matching `where` it lacks."""
+    columns = [f"CAST({expr} AS {sql_type}) AS {name}" for name, (sql_type, expr) in node.sources.items()]
+    if node.key_source:
+        return f"""
+            INSERT INTO {node.table}
+            SELECT DISTINCT {node.key_source} AS {node.key}, {', '.join(columns)}
+            FROM divvy_data
+            WHERE ({where}) AND {node.key_source} IS NOT NULL
+              AND {node.key_source} NOT IN (SELECT {node.key} FROM {node.table})
+        """
+    matches = ' AND '.join(f"d.{name} IS NOT DISTINCT FROM n.{name}" for name in node.sources)
+    return f"""
+        INSERT INTO {node.table}
+        SELECT CAST((SELECT COALESCE(MAX({node.key}), 0) FROM {node.table})
+                    + ROW_NUMBER() OVER (ORDER BY {', '.join(node.sources)}) AS INTEGER) AS {node.key}, *
+        FROM (SELECT DISTINCT {', '.join(columns)} FROM divvy_data WHERE {where}) n
+        WHERE NOT EXISTS (SELECT 1 FROM {node.table} d WHERE {matches})
+    """
+
+
+def fact_query(fact=trip_node, relationships=RELATIONSHIPS, where=None):
+    """
+    CREATE TABLE ... AS for the fact node: its foreign keys followed by its
+    measures. With `where` set, INSERT the divvy_data rows matching it instead.
+    """
+    columns, joins = [], []
+    for i, rel in enumerate(relationships):
+        end = rel.end_node
+        if end.key_source:
+            columns.append(f"{end.key_source} AS {rel.foreign_key}")  # computed, no join needed
+        else:
+            alias = f"j{i}"
+            conditions = [f"{alias}.{prop} IS NOT DISTINCT FROM d.{expr}"
+                          for prop, expr in RELATIONSHIP_MATCHES[rel.type].items()]
+            joins.append(f"LEFT JOIN {end.table} {alias} ON {' AND '.join(conditions)}")
+            columns.append(f"{alias}.{end.key} AS {rel.foreign_key}")
+    columns += [f"CAST(d.{expr} AS {sql_type}) AS {name}" for name, (sql_type, expr) in fact.sources.items()]
+    select = f"""
+        SELECT {', '.join(columns)}
+        FROM divvy_data d
+        {' '.join(joins)}
+    """
+    if where:
+        return f"INSERT INTO {fact.table} BY NAME {select} WHERE {where}"
+    return f"CREATE OR REPLACE TABLE {fact.table} AS {select}"
+
+
+def manifest_query(duckdb_conn):
+    """
+    SELECT of (source_file, content_hash) for every file in ingest_manifest,
+    creating the star_schema_files table it is compared against if needed.
+    """
+    duckdb_conn.execute("""
+        CREATE TABLE IF NOT EXISTS star_schema_files (
+            source_file VARCHAR PRIMARY KEY,
+            content_hash VARCHAR
+        )
+    """)
+    has_manifest = duckdb_conn.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'ingest_manifest'").fetchone()[0]
+    if has_manifest:
+        return "SELECT path AS source_file, content_hash FROM ingest_manifest"
+    return "SELECT NULL::VARCHAR AS source_file, NULL::VARCHAR AS content_hash WHERE false"
+
+
+def record_star_schema_files(duckdb_conn, manifest):
+    """Remember which version (manifest hash) of every source file trip_fact now holds."""
+    duckdb_conn.execute("DELETE FROM star_schema_files")
+    duckdb_conn.execute(f"INSERT INTO star_schema_files {manifest}")
+
+
+def load_star_schema(duckdb_conn, build_stations=True):
+    """
+    Build every dimension table, then the narrow trip_fact table with an
+    integer foreign key per relationship. Pass build_stations=False when
+    station_dim is already current. Returns the trip_fact row count.
+    """
+    for node in NODES:
+        if node is station_node:
+            if build_stations:
+                stations.build_station_dim(duckdb_conn)
+        elif node is not trip_node:
+            duckdb_conn.execute(dimension_query(node))
+    duckdb_conn.execute(fact_query())
+    record_star_schema_files(duckdb_conn, manifest_query(duckdb_conn))
+    count = duckdb_conn.execute(f"SELECT COUNT(*) FROM {trip_node.table}").fetchone()[0]
+    print(f"Loaded {trip_node.table} with {count} trips.")
+    return count
+
+
+def refresh_star_schema(duckdb_conn, build_stations=True):
+    """
+    Bring the star schema up to date with divvy_data without rebuilding it:
+    only the trips of source files whose trip count or ingest_manifest hash
+    changed since the last refresh are deleted from trip_fact and loaded
+    again, and the dimensions gain the rows those trips need. Falls back to
+    load_star_schema when there is no trip_fact yet. Pass build_stations=False
+    when station_dim is already current. Returns the number of trips (re)loaded.
+    """
+    manifest = manifest_query(duckdb_conn)
+    has_fact = duckdb_conn.execute(f"""
+        SELECT COUNT(*) FROM duckdb_columns()
+        WHERE table_name = '{trip_node.table}' AND column_name = 'source_file'
+    """).fetchone()[0]
+    if not has_fact:
+        return load_star_schema(duckdb_conn, build_stations)
+
+    # A reloaded file can keep its trip count, so its manifest hash is compared too
+    stale = [row[0] for row in duckdb_conn.execute(f"""
+        SELECT source_file FROM (
+            SELECT source_file, COUNT(*) AS trips FROM divvy_data GROUP BY ALL
+        ) d
+        FULL OUTER JOIN (
+            SELECT source_file, COUNT(*) AS trips FROM {trip_node.table} GROUP BY ALL
+        ) f USING (source_file)
+        WHERE d.trips IS DISTINCT FROM f.trips
+        UNION
+        SELECT m.source_file FROM ({manifest}) m
+        LEFT JOIN star_schema_files s USING (source_file)
+        WHERE s.content_hash IS DISTINCT FROM m.content_hash
+    """).fetchall()]
+    if not stale:
+        print(f"{trip_node.table} is up to date.")
+        return 0
+
+    if build_stations:
+        stations.build_station_dim(duckdb_conn)
+    duckdb_conn.execute("CREATE OR REPLACE TEMP TABLE stale_files (source_file VARCHAR)")
+    duckdb_conn.executemany("INSERT INTO stale_files VALUES (?)", [[path] for path in stale])
+    where = "(source_file IN (SELECT source_file FROM stale_files) OR source_file IS NULL)"
+    duckdb_conn.execute("BEGIN TRANSACTION")
+    try:
+        for node in NODES:
+            if node is not trip_node and node is not station_node:
+                duckdb_conn.execute(extend_dimension_query(node, where))
+        duckdb_conn.execute(f"DELETE FROM {trip_node.table} WHERE {where}")
+        duckdb_conn.execute(fact_query(where=where))
+        record_star_schema_files(duckdb_conn, manifest)
+        duckdb_conn.execute("COMMIT")
+    except Exception:
+        duckdb_conn.execute("ROLLBACK")
+        raise
+    count = duckdb_conn.execute(f"SELECT COUNT(*) FROM {trip_node.table} WHERE {where}").fetchone()[0]
+    duckdb_conn.execute("DROP TABLE stale_files")
+    print(f"Refreshed {trip_node.table}: {count} trips from {len(stale)} changed source file(s).")
+    return count
+
+
+def validate_star_schema(duckdb_conn):
+    """
+    Check the star schema against divvy_data: one fact row per trip, the same
+    total duration, unique dimension keys, and a dimension row behind every
+    foreign key wherever divvy_data had a value. Returns a list of problems
+    (empty when the schema is consistent).
+    """
+    problems = []
+    trips, duration = duckdb_conn.execute("SELECT COUNT(*), SUM(trip_duration) FROM divvy_data").fetchone()
+    facts, fact_duration = duckdb_conn.execute(
+        f"SELECT COUNT(*), SUM(trip_duration) FROM {trip_node.table}").fetchone()
+    if facts != trips:
+        problems.append(f"{trip_node.table} has {facts} rows, divvy_data has {trips}")
+    if fact_duration != duration:
+        problems.append(f"{trip_node.table} trip_duration sums to {fact_duration}, divvy_data to {duration}")
+
+    for node in NODES:
+        if node.key is None:
+            continue
+        rows, keys = duckdb_conn.execute(
+            f"SELECT COUNT(*), COUNT(DISTINCT {node.key}) FROM {node.table}").fetchone()
+        if rows != keys:
+            problems.append(f"{node.table}.{node.key} is not unique ({rows} rows, {keys} keys)")
+
+    for rel in RELATIONSHIPS:
+        end = rel.end_node
+        missing = duckdb_conn.execute(f"""
+            SELECT COUNT(*) FROM {trip_node.table} f
+            WHERE f.{rel.foreign_key} IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM {end.table} x WHERE x.{end.key} = f.{rel.foreign_key})
+        """).fetchone()[0]
+        if missing:
+            problems.append(f"{missing} {rel.type} keys have no row in {end.table}")
+
+        # A key may only be missing where divvy_data has nothing to look up
+        if end.key_source:
+            unmatched = f"{end.key_source} IS NULL"
+        elif end is station_node:
+            unmatched = ' OR '.join(f"{expr} IS NULL" for expr in RELATIONSHIP_MATCHES[rel.type].values())
+        else:
+            unmatched = "FALSE"  # NULL properties match too, so every row has a key
+        null_keys = duckdb_conn.execute(
+            f"SELECT COUNT(*) FROM {trip_node.table} WHERE {rel.foreign_key} IS NULL").fetchone()[0]
+        expected = duckdb_conn.execute(f"SELECT COUNT(*) FROM divvy_data WHERE {unmatched}").fetchone()[0]
+        if null_keys != expected:
+            problems.append(f"{null_keys} trips have no {rel.type} key, expected {expected}")
+    return problems
+
+
+# The columns the analysis cube needs, read from the star schema instead of divvy_data
+STAR_CUBE_SOURCE = f"""
+    SELECT
+        t.year AS st_year,
+        t.month AS st_month,
+        t.day AS st_day,
+        r.gender,
+        s.station_name AS start_station_name,
+        f.trip_duration,
+        r.age
+    FROM {trip_node.table} f
+    LEFT JOIN {time_node.table} t ON t.{time_node.key} = f.{occurs_on.foreign_key}
+    LEFT JOIN {rider_node.table} r ON r.{rider_node.key} = f.{taken_by.foreign_key}
+    LEFT JOIN {station_node.table} s ON s.{station_node.key} = f.{starts_at.foreign_key}
+"""
+
+# The same columns for trips not in trip_fact yet, read from `{{trips}}` (shaped
+# like divvy_data, with its st_ date parts). Only the station name differs from
+# divvy_data's, so it is looked up in station_dim the way trip_fact's key is.
+STAR_CUBE_BATCH_SOURCE = f"""
+    SELECT
+        d.st_year,
+        d.st_month,
+        d.st_day,
+        d.gender,
+        s.station_name AS start_station_name,
+        d.trip_duration,
+        d.age
+    FROM {{trips}} d
+    LEFT JOIN {station_node.table} s ON {' AND '.join(f"s.{prop} IS NOT DISTINCT FROM d.{expr}"
+                                                      for prop, expr in RELATIONSHIP_MATCHES[starts_at.type].items())}
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the trip model, or load it into DuckDB as a star schema.")
+    parser.add_argument("--load", action="store_true",
+                        help="build the dimension and fact tables from divvy_data and validate them")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+
+    print("Nodes:")
+    for node in NODES:
+        print(f" {node.label}: {', '.join(node.properties)}")
+
+    print("\nRelationships:")
+    for rel in RELATIONSHIPS:
+        print(f" ({rel.start_node.label})-[{rel.type}]->({rel.end_node.label})")
+
+    if args.load:
+        settings = config.config_from_args(args)
+        with duckdb.connect(settings['database']) as conn:
+            config.apply_duckdb_settings(conn, settings)
+            load_star_schema(conn)
+            problems = validate_star_schema(conn)
+        print("\nStar schema is valid." if not problems else "\nStar schema problems:\n " + "\n ".join(problems))
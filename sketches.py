@@ -0,0 +1,174 @@
+import argparse
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+
+import config
+import results_store
+
+# Quantile sketches keep trip_duration counts in logarithmic buckets, so any
+# quantile read back from them is within RELATIVE_ACCURACY of the true value
+# (as in DDSketch). Distinct end stations are kept as exact sets of station
+# ids, a few hundred at most. Both merge across months by simple addition
+# (buckets) and union (stations).
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+DIMENSIONS = ['all', 'station', 'gender', 'age_group']
+
+# The grouping sets used for both halves of a sketch, with `{column}` the
+# bucket or the end station
+SKETCH_GROUPING_SETS = """
+    (month_key, {column}), (month_key, station, {column}),
+    (month_key, gender, {column}), (month_key, age_group, {column})
+"""
+
+SKETCH_DIMENSION = """
+    CASE
+        WHEN GROUPING(station) = 0 THEN 'station'
+        WHEN GROUPING(gender) = 0 THEN 'gender'
+        WHEN GROUPING(age_group) = 0 THEN 'age_group'
+        ELSE 'all'
+    END AS dimension,
+    CASE
+        WHEN GROUPING(station) = 0 THEN station
+        WHEN GROUPING(gender) = 0 THEN gender
+        WHEN GROUPING(age_group) = 0 THEN age_group
+        ELSE 'all'
+    END AS value
+"""
+
+# One scan of divvy_data builds every sketch: per month and per start station,
+# gender and age group (and overall), one row holding the trip count, the
+# duration bucket counts serialized as 'bucket:trips,...' and the end stations
+# reached as 'id,id,...'. Neither list is ordered; ordering them would double
+# the build time and readers merge them anyway.
+SKETCH_QUERY = f"""
+    CREATE OR REPLACE TABLE trip_sketch_results AS
+    WITH trips AS (
+        SELECT
+            CAST(st_year AS INTEGER) * 100 + st_month AS month_key,
+            start_station_name AS station,
+            CASE
+                WHEN gender = 0 THEN 'Male'
+                WHEN gender = 1 THEN 'Female'
+            END AS gender,
+            CASE
+                WHEN age < 25 THEN 'Under 25'
+                WHEN age BETWEEN 25 AND 35 THEN '25-35'
+                WHEN age BETWEEN 36 AND 50 THEN '36-50'
+                ELSE 'Over 50'
+            END AS age_group,
+            CAST(ceil(ln(greatest(trip_duration, 1)) / ln({GAMMA})) AS INTEGER) AS bucket,
+            end_station_id
+        FROM divvy_data
+        WHERE st_year IS NOT NULL AND st_month IS NOT NULL
+    ),
+    durations AS (
+        SELECT month_key, dimension, value, SUM(trips) AS trips,
+               string_agg(bucket || ':' || trips, ',') AS durations
+        FROM (
+            SELECT {SKETCH_DIMENSION}, month_key, bucket, COUNT(*) AS trips
+            FROM trips
+            GROUP BY GROUPING SETS ({SKETCH_GROUPING_SETS.format(column='bucket')})
+        )
+        WHERE value IS NOT NULL
+        GROUP BY ALL
+    ),
+    end_stations AS (
+        SELECT month_key, dimension, value, string_agg(end_station_id, ',') AS end_stations
+        FROM (
+            SELECT {SKETCH_DIMENSION}, month_key, end_station_id
+            FROM trips
+            WHERE end_station_id IS NOT NULL
+            GROUP BY GROUPING SETS ({SKETCH_GROUPING_SETS.format(column='end_station_id')})
+        )
+        WHERE value IS NOT NULL
+        GROUP BY ALL
+    )
+    SELECT month_key, dimension, value, trips, durations, end_stations
+    FROM durations
+    LEFT JOIN end_stations USING (month_key, dimension, value)
+"""
+
+
+def build_sketches(duckdb_conn):
+    """
+    Build every sketch in one pass into trip_sketch_results (month_key,
+    dimension, value, trips, durations, end_stations), ready for export.
+    Returns the number of sketches.
+    """
+    duckdb_conn.execute(SKETCH_QUERY)
+    count = duckdb_conn.execute("SELECT COUNT(*) FROM trip_sketch_results").fetchone()[0]
+    print(f"Built {count} monthly trip sketches.")
+    return count
+
+
+def bucket_value(bucket):
+    """Representative duration of a bucket: within RELATIVE_ACCURACY of every value in it."""
+    return 2 * GAMMA ** np.asarray(bucket, dtype=float) / (GAMMA + 1)
+
+
+def duration_quantiles(sketches, quantiles=(0.5, 0.95, 0.99)):
+    """
+    Merge the durations of sketch rows (a DataFrame with a durations column,
+    from any number of months) and return {quantile: duration in seconds}.
+    Quantiles of an empty sketch are None.
+    """
+    merged = {}
+    for durations in sketches['durations'].dropna():
+        for entry in durations.split(','):
+            bucket, trips = entry.split(':')
+            merged[int(bucket)] = merged.get(int(bucket), 0) + int(trips)
+    if not merged:
+        return {q: None for q in quantiles}
+    buckets = np.array(sorted(merged))
+    cumulative = np.cumsum([merged[bucket] for bucket in buckets])
+    ranks = np.asarray(quantiles) * (cumulative[-1] - 1)
+    positions = np.searchsorted(cumulative, ranks, side='right')
+    values = bucket_value(buckets[positions])
+    return {q: float(v) for q, v in zip(quantiles, values)}
+
+
+def distinct_end_stations(sketches):
+    """
+    Merge the end station sets of sketch rows (a DataFrame with an
+    end_stations column, from any number of months) and count them.
+    """
+    stations = set()
+    for end_stations in sketches['end_stations'].dropna():
+        stations.update(end_stations.split(','))
+    return len(stations)
+
+
+def sketch_filters(dimension, value, months=None):
+    """Filters selecting one dimension value, optionally within a (first, last) month_key range."""
+    filters = {'dimension': dimension, 'value': value}
+    if months is not None:
+        filters['month_key'] = tuple(months)
+    return filters
+
+
+# Main function
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Duration percentiles and distinct stations from the exported sketches.")
+    parser.add_argument("--dimension", choices=DIMENSIONS, default="all")
+    parser.add_argument("--value", default="all", help="station name, gender or age group (default: all)")
+    parser.add_argument("--from", dest="first", type=int, default=None, help="first month, e.g. 201601")
+    parser.add_argument("--to", dest="last", type=int, default=None, help="last month, e.g. 201612")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+    settings = config.config_from_args(args)
+
+    months = None
+    if args.first is not None or args.last is not None:
+        months = (args.first or 0, args.last or 999999)
+    filters = sketch_filters(args.dimension, args.value, months)
+    with closing(sqlite3.connect(settings['sqlite_db'])) as conn:
+        sketch = results_store.fetch_page(conn, 'trip_sketch_results',
+                                          ['trips', 'durations', 'end_stations'], filters)
+    for q, seconds in duration_quantiles(sketch).items():
+        print(f"p{q * 100:g}: " + ("no trips" if seconds is None else f"{seconds:.0f}s"))
+    print(f"Trips: {int(sketch['trips'].sum())}")
+    print(f"Distinct end stations: {distinct_end_stations(sketch)}")
@@ -0,0 +1,229 @@
+import argparse
+import heapq
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+import config
+import schema
+
+# One directed edge per (start station, end station) pair that has trips, as
+# station_dim keys, following the STARTS_AT and ENDS_AT relationships of
+# schema.py. Trips whose start or end station is unknown are left out.
+EDGES_QUERY = f"""
+    SELECT
+        s.{schema.station_node.key} AS start_key,
+        e.{schema.station_node.key} AS end_key,
+        COUNT(*) AS trips,
+        AVG(d.trip_duration) AS mean_duration
+    FROM divvy_data d
+    JOIN {schema.station_node.table} s
+        ON s.station_id = d.{schema.RELATIONSHIP_MATCHES[schema.starts_at.type]['station_id']}
+    JOIN {schema.station_node.table} e
+        ON e.station_id = d.{schema.RELATIONSHIP_MATCHES[schema.ends_at.type]['station_id']}
+    GROUP BY ALL
+    ORDER BY start_key, end_key
+"""
+
+
+class StationGraph:
+    """
+    The station network as CSR arrays: the edges out of station i (position
+    i = station_key - 1) are indices[indptr[i]:indptr[i + 1]], with their trip
+    counts in trips and their mean ride time in seconds in mean_duration.
+    """
+
+    def __init__(self, n_stations, start_keys, end_keys, trips, mean_duration):
+        order = np.lexsort((end_keys, start_keys))
+        starts = np.asarray(start_keys, dtype=np.int64)[order] - 1
+        self.n_stations = int(n_stations)
+        self.indptr = np.zeros(self.n_stations + 1, dtype=np.int64)
+        np.cumsum(np.bincount(starts, minlength=self.n_stations), out=self.indptr[1:])
+        self.indices = (np.asarray(end_keys, dtype=np.int64)[order] - 1).astype(np.int32)
+        self.trips = np.asarray(trips, dtype=np.int64)[order]
+        self.mean_duration = np.nan_to_num(np.asarray(mean_duration, dtype=np.float64)[order])
+        # Start position of every edge, for vectorized passes over all edges
+        self._sources = starts
+
+    @classmethod
+    def from_duckdb(cls, duckdb_conn):
+        """Build the graph from divvy_data and station_dim (which must be current)."""
+        n_stations = duckdb_conn.execute(
+            f"SELECT COALESCE(MAX({schema.station_node.key}), 0) FROM {schema.station_node.table}").fetchone()[0]
+        edges = duckdb_conn.execute(EDGES_QUERY).fetchnumpy()
+        return cls(n_stations, edges['start_key'], edges['end_key'], edges['trips'], edges['mean_duration'])
+
+    def out_degree(self):
+        """Number of distinct stations reached from each station."""
+        return np.diff(self.indptr)
+
+    def in_degree(self):
+        """Number of distinct stations each station is reached from."""
+        return np.bincount(self.indices, minlength=self.n_stations)
+
+    def trips_out(self):
+        return np.bincount(self._sources, weights=self.trips, minlength=self.n_stations).astype(np.int64)
+
+    def trips_in(self):
+        return np.bincount(self.indices, weights=self.trips, minlength=self.n_stations).astype(np.int64)
+
+    def pagerank(self, damping=0.85, tol=1e-10, max_iter=100):
+        """
+        PageRank where a rider leaves a station along each edge in proportion
+        to its trips. Stations nobody rides out of hand their rank to every
+        station evenly. Returns one score per station, summing to 1.
+        """
+        n = self.n_stations
+        if n == 0:
+            return np.array([])
+        trips_out = self.trips_out()
+        share = self.trips / trips_out[self._sources]
+        dangling = trips_out == 0
+        rank = np.full(n, 1.0 / n)
+        for _ in range(max_iter):
+            spread = np.bincount(self.indices, weights=rank[self._sources] * share, minlength=n)
+            new_rank = (1 - damping) / n + damping * (spread + rank[dangling].sum() / n)
+            converged = np.abs(new_rank - rank).sum() < tol
+            rank = new_rank
+            if converged:
+                break
+        return rank
+
+    def components(self):
+        """
+        Weakly connected components, numbered from 1 by decreasing size.
+        Returns (component of each station, size of each station's component).
+        """
+        labels = np.arange(self.n_stations)
+        while True:
+            previous = labels
+            labels = labels.copy()
+            # Every edge pulls both of its ends down to the smaller label,
+            # then each label jumps to its own label's label
+            np.minimum.at(labels, self.indices, labels[self._sources])
+            np.minimum.at(labels, self._sources, labels[self.indices])
+            labels = labels[labels]
+            if np.array_equal(labels, previous):
+                break
+        roots, inverse, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+        # Renumber so component 1 is the largest
+        by_size = np.argsort(-sizes, kind='stable')
+        number = np.empty(len(roots), dtype=np.int64)
+        number[by_size] = np.arange(1, len(roots) + 1)
+        return number[inverse], sizes[inverse]
+
+    def shortest_paths(self, station_key, weight='duration'):
+        """
+        Dijkstra from one station along ridden edges. weight='duration' costs
+        each edge its mean ride time in seconds, weight='hops' costs 1.
+        Returns (cost to every station, inf where unreachable; predecessor
+        position of every station on its path, -1 where there is none).
+        """
+        cost = self.mean_duration if weight == 'duration' else np.ones(len(self.indices))
+        # Plain lists are much faster than numpy scalars in the loop below
+        indptr, indices, cost = self.indptr.tolist(), self.indices.tolist(), cost.tolist()
+        dist = [float('inf')] * self.n_stations
+        previous = [-1] * self.n_stations
+        source = int(station_key) - 1
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for edge in range(indptr[node], indptr[node + 1]):
+                target = indices[edge]
+                candidate = d + cost[edge]
+                if candidate < dist[target]:
+                    dist[target] = candidate
+                    previous[target] = node
+                    heapq.heappush(heap, (candidate, target))
+        return np.array(dist), np.array(previous, dtype=np.int64)
+
+    def path(self, start_key, end_key, weight='duration'):
+        """Station keys along the cheapest route from start_key to end_key, [] if there is none."""
+        dist, previous = self.shortest_paths(start_key, weight)
+        if not np.isfinite(dist[end_key - 1]):
+            return []
+        route = [end_key - 1]
+        while route[-1] != start_key - 1:
+            route.append(previous[route[-1]])
+        return [int(position) + 1 for position in reversed(route)]
+
+    def centrality(self):
+        """Degree, trip totals, PageRank and component of every station, as a DataFrame."""
+        component, component_size = self.components()
+        pagerank = self.pagerank()
+        result = pd.DataFrame({
+            'station_key': np.arange(1, self.n_stations + 1),
+            'out_degree': self.out_degree(),
+            'in_degree': self.in_degree(),
+            'trips_out': self.trips_out(),
+            'trips_in': self.trips_in(),
+            'pagerank': pagerank,
+            'component': component,
+            'component_size': component_size,
+        })
+        result.insert(6, 'pagerank_rank', result['pagerank'].rank(ascending=False, method='min').astype(np.int64))
+        return result
+
+
+def build_station_centrality(duckdb_conn):
+    """
+    Compute StationGraph.centrality and store it with station ids and names
+    as the station_centrality_results table, ready for export. Returns its row count.
+    """
+    graph = StationGraph.from_duckdb(duckdb_conn)
+    centrality = graph.centrality()
+    cursor = duckdb_conn.cursor()
+    try:
+        cursor.register('centrality_df', centrality)
+        cursor.execute(f"""
+            CREATE OR REPLACE TABLE station_centrality_results AS
+            SELECT s.station_id, s.station_name, c.*
+            FROM centrality_df c
+            JOIN {schema.station_node.table} s USING ({schema.station_node.key})
+            ORDER BY c.pagerank_rank, c.station_key
+        """)
+        cursor.unregister('centrality_df')
+    finally:
+        cursor.close()
+    print(f"Built station_centrality_results for {graph.n_stations} stations and {len(graph.indices)} edges.")
+    return len(centrality)
+
+
+# Main function
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank stations by network importance and find routes between them.")
+    parser.add_argument("--top", type=int, default=10, help="number of stations to list by PageRank")
+    parser.add_argument("--from", dest="start", default=None, help="station name to route from")
+    parser.add_argument("--to", dest="end", default=None, help="station name to route to")
+    parser.add_argument("--weight", choices=["duration", "hops"], default="duration",
+                        help="cost of an edge: mean ride time or one per hop")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+    settings = config.config_from_args(args)
+
+    with duckdb.connect(settings['database'], read_only=True) as conn:
+        config.apply_duckdb_settings(conn, settings)
+        graph = StationGraph.from_duckdb(conn)
+        names = conn.execute("SELECT station_key, station_name FROM station_dim").fetchdf()
+        names = names.set_index('station_key')['station_name']
+
+        centrality = graph.centrality()
+        centrality.insert(1, 'station_name', centrality['station_key'].map(names))
+        print(centrality.sort_values('pagerank_rank').head(args.top).to_string(index=False))
+
+        if args.start and args.end:
+            keys = {name: key for key, name in names.items()}
+            for name in (args.start, args.end):
+                if name not in keys:
+                    raise SystemExit(f"Unknown station '{name}'")
+            route = graph.path(keys[args.start], keys[args.end], args.weight)
+            if route:
+                dist, _ = graph.shortest_paths(keys[args.start], args.weight)
+                print(f"\nRoute ({args.weight} {dist[keys[args.end] - 1]:.0f}): "
+                      + " -> ".join(names[key] for key in route))
+            else:
+                print(f"\nNo route from {args.start} to {args.end}.")
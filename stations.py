@@ -0,0 +1,267 @@
+import argparse
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+import config
+
+EARTH_RADIUS_KM = 6371.0088
+
+# One row per station, built from both ends of every trip. The attribute
+# columns follow the Station node in schema.py; station_key is an integer
+# surrogate for station_id (which is text, e.g. '85' or 'TA1306000007').
+# Where a station's attributes vary between trips the most frequent value wins.
+# A rebuild keeps the key of every station already in {previous}, so trip_fact
+# rows that point at it stay valid, and numbers new stations after them.
+STATION_DIM_QUERY = """
+    CREATE OR REPLACE TABLE station_dim AS
+    WITH endpoints AS (
+        SELECT
+            start_station_id AS station_id,
+            start_station_name AS station_name,
+            start_lat AS latitude,
+            start_lng AS longitude,
+            start_city AS city,
+            start_landmark AS landmark,
+            start_dpcapacity AS dpcapacity,
+            1 AS is_start
+        FROM divvy_data
+        UNION ALL
+        SELECT end_station_id, end_station_name, end_lat, end_lng,
+               end_city, end_landmark, end_dpcapacity, 0
+        FROM divvy_data
+    ),
+    stats AS (
+        SELECT
+            station_id,
+            mode(station_name) AS station_name,
+            mode(latitude) AS latitude,
+            mode(longitude) AS longitude,
+            mode(city) AS city,
+            mode(landmark) AS landmark,
+            mode(dpcapacity) AS dpcapacity,
+            CAST(SUM(is_start) AS BIGINT) AS trips_started,
+            CAST(COUNT(*) - SUM(is_start) AS BIGINT) AS trips_ended
+        FROM endpoints
+        WHERE station_id IS NOT NULL
+        GROUP BY station_id
+    ),
+    previous AS ({previous})
+    SELECT
+        CAST(COALESCE(p.station_key, (SELECT COALESCE(MAX(station_key), 0) FROM previous)
+             + ROW_NUMBER() OVER (PARTITION BY p.station_key IS NULL ORDER BY s.station_id)) AS INTEGER)
+            AS station_key,
+        s.*
+    FROM stats s
+    LEFT JOIN previous p USING (station_id)
+    ORDER BY station_key
+"""
+
+
+def build_station_dim(duckdb_conn):
+    """Materialize station_dim from divvy_data, keeping existing station keys, and return its row count."""
+    exists = duckdb_conn.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'station_dim'").fetchone()[0]
+    previous = ("SELECT station_id, station_key FROM station_dim" if exists
+                else "SELECT NULL::VARCHAR AS station_id, NULL::INTEGER AS station_key WHERE false")
+    duckdb_conn.execute(STATION_DIM_QUERY.format(previous=previous))
+    count = duckdb_conn.execute("SELECT COUNT(*) FROM station_dim").fetchone()[0]
+    print(f"Built station_dim with {count} stations.")
+    return count
+
+
+def load_station_dim(duckdb_conn):
+    """Return station_dim as a DataFrame."""
+    return duckdb_conn.execute("SELECT * FROM station_dim ORDER BY station_key").fetchdf()
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km; every argument may be a scalar or a numpy array."""
+    lat1, lng1, lat2, lng2 = (np.radians(v) for v in (lat1, lng1, lat2, lng2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class StationIndex:
+    """
+    A uniform grid over station coordinates for nearest-station and
+    within-radius lookups. Stations are sorted by grid cell, so the stations
+    of any cell are one contiguous slice found with a binary search; every
+    query method takes arrays of points and answers them all at once.
+    """
+
+    def __init__(self, stations, cell_km=None):
+        # Stations without usable coordinates cannot be located
+        valid = (stations['latitude'].notna() & stations['longitude'].notna()
+                 & (stations['latitude'] != 0) & (stations['longitude'] != 0))
+        self.stations = stations[valid].reset_index(drop=True)
+
+        # Equirectangular projection around the stations' mean latitude: at
+        # city scale it is within a fraction of a percent of true distance
+        self._lat0 = float(np.radians(self.stations['latitude'].mean())) if len(self.stations) else 0.0
+        x, y = self._project(self.stations['latitude'].to_numpy(), self.stations['longitude'].to_numpy())
+        if cell_km is None:
+            # About four stations per cell where the central half of them are
+            if len(x) > 1:
+                spread_x, spread_y = (np.subtract(*np.percentile(v, [75, 25])) for v in (x, y))
+                cell_km = float(np.sqrt(8 * max(spread_x, 0.01) * max(spread_y, 0.01) / len(x)))
+            else:
+                cell_km = 1.0
+        self.cell_km = max(cell_km, 0.01)
+
+        cells = self._cell_keys_of(x, y)
+        order = np.argsort(cells, kind='stable')
+        self.stations = self.stations.iloc[order].reset_index(drop=True)
+        self._cell_keys = cells[order]
+        self._lat = self.stations['latitude'].to_numpy()
+        self._lng = self.stations['longitude'].to_numpy()
+        self._keys = self.stations['station_key'].to_numpy()
+
+    @classmethod
+    def from_duckdb(cls, duckdb_conn, cell_km=None):
+        """Build the index from the station_dim table."""
+        return cls(load_station_dim(duckdb_conn), cell_km)
+
+    def _project(self, lat, lng):
+        """Planar x/y in km."""
+        return (np.radians(lng) * np.cos(self._lat0) * EARTH_RADIUS_KM,
+                np.radians(lat) * EARTH_RADIUS_KM)
+
+    def _cell_xy(self, lat, lng):
+        x, y = self._project(lat, lng)
+        return np.floor(x / self.cell_km).astype(np.int64), np.floor(y / self.cell_km).astype(np.int64)
+
+    def _cell_keys_of(self, x, y):
+        return (np.floor(x / self.cell_km).astype(np.int64) << 32) + np.floor(y / self.cell_km).astype(np.int64)
+
+    def _candidates(self, lat, lng, ring):
+        """
+        (query, station position) pairs for every station in the
+        (2 * ring + 1)^2 cells around each query point.
+        """
+        cx, cy = self._cell_xy(lat, lng)
+        dx, dy = np.meshgrid(np.arange(-ring, ring + 1), np.arange(-ring, ring + 1))
+        keys = ((cx[:, None] + dx.ravel()) << 32) + (cy[:, None] + dy.ravel())
+        lo = np.searchsorted(self._cell_keys, keys.ravel(), 'left')
+        hi = np.searchsorted(self._cell_keys, keys.ravel(), 'right')
+        counts = hi - lo
+        query = np.repeat(np.repeat(np.arange(len(lat)), keys.shape[1]), counts)
+        # Expand each [lo, hi) slice into the positions it covers
+        position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+        return query, position
+
+    def _chunks(self, n_queries, per_query, max_pairs=4_000_000):
+        """Split queries into chunks of at most max_pairs work items, per_query items each."""
+        step = max(1, max_pairs // max(per_query, 1))
+        return [np.arange(i, min(i + step, n_queries)) for i in range(0, n_queries, step)]
+
+    def _grid_helps(self, ring):
+        """False once scanning the ring's cells costs about as much as comparing with every station."""
+        return (2 * ring + 1) ** 2 * 8 < len(self._keys)
+
+    def within_radius(self, lat, lng, radius_km):
+        """
+        Every station within radius_km of each (lat, lng) point. Returns a
+        DataFrame with the query's position, station_key, station_id,
+        station_name and distance_km, nearest first within each query.
+        """
+        lat, lng = np.atleast_1d(np.asarray(lat, dtype=float)), np.atleast_1d(np.asarray(lng, dtype=float))
+        ring = int(np.ceil(radius_km * 1.01 / self.cell_km))
+        parts = [(np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([]))]
+        if self._grid_helps(ring):
+            for chunk in self._chunks(len(lat), (2 * ring + 1) ** 2):
+                query, position = self._candidates(lat[chunk], lng[chunk], ring)
+                distance = haversine_km(lat[chunk][query], lng[chunk][query], self._lat[position], self._lng[position])
+                keep = distance <= radius_km
+                parts.append((chunk[query[keep]], position[keep], distance[keep]))
+        else:
+            for chunk in self._chunks(len(lat), len(self._keys)):
+                distance = haversine_km(lat[chunk, None], lng[chunk, None], self._lat, self._lng)
+                row, position = np.nonzero(distance <= radius_km)
+                parts.append((chunk[row], position, distance[row, position]))
+        return self._result(*(np.concatenate(p) for p in zip(*parts)))
+
+    def nearest(self, lat, lng, k=5):
+        """
+        The k nearest stations to each (lat, lng) point, as a DataFrame with
+        the query's position, rank (1 = nearest), station_key, station_id,
+        station_name and distance_km.
+        """
+        lat, lng = np.atleast_1d(np.asarray(lat, dtype=float)), np.atleast_1d(np.asarray(lng, dtype=float))
+        k = min(k, len(self._keys))
+        parts = [(np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([]))]
+        todo = np.arange(len(lat)) if k else np.array([], dtype=np.int64)
+        ring = 1
+        while len(todo) and self._grid_helps(ring):
+            unresolved = []
+            for chunk in self._chunks(len(todo), (2 * ring + 1) ** 2):
+                queries = todo[chunk]
+                query, position = self._candidates(lat[queries], lng[queries], ring)
+
+                # Candidates as one padded row per query, so the k smallest
+                # distances of every row come from a single partition
+                counts = np.bincount(query, minlength=len(queries))
+                column = np.arange(len(query)) - np.repeat(np.cumsum(counts) - counts, counts)
+                positions = np.zeros((len(queries), max(counts.max(initial=0), k)), dtype=np.int64)
+                distances = np.full(positions.shape, np.inf)
+                positions[query, column] = position
+                distances[query, column] = haversine_km(lat[queries][query], lng[queries][query],
+                                                        self._lat[position], self._lng[position])
+                smallest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                distances = np.take_along_axis(distances, smallest, axis=1)
+                positions = np.take_along_axis(positions, smallest, axis=1)
+
+                # A query is answered once its k nearest candidates all lie closer
+                # than any station outside the searched cells could be
+                done = (distances <= ring * self.cell_km * 0.99).all(axis=1)
+                parts.append((np.repeat(queries[done], k), positions[done].ravel(), distances[done].ravel()))
+                unresolved.append(queries[~done])
+            todo = np.concatenate(unresolved)
+            ring *= 2
+
+        # Queries the grid could not settle cheaply: compare with every station
+        for chunk in self._chunks(len(todo), len(self._keys)):
+            queries = todo[chunk]
+            distances = haversine_km(lat[queries, None], lng[queries, None], self._lat, self._lng)
+            positions = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            distances = np.take_along_axis(distances, positions, axis=1)
+            parts.append((np.repeat(queries, k), positions.ravel(), distances.ravel()))
+
+        result = self._result(*(np.concatenate(p) for p in zip(*parts)))
+        result.insert(1, 'rank', result.groupby('query').cumcount() + 1)
+        return result
+
+    def _result(self, query, position, distance):
+        order = np.lexsort((distance, query))
+        query, position, distance = query[order], position[order], distance[order]
+        return pd.DataFrame({
+            'query': query,
+            'station_key': self._keys[position],
+            'station_id': self.stations['station_id'].to_numpy()[position],
+            'station_name': self.stations['station_name'].to_numpy()[position],
+            'distance_km': distance,
+        })
+
+
+# Main function
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build station_dim and look up stations near a point.")
+    parser.add_argument("--lat", type=float, default=None, help="latitude of a point to search around")
+    parser.add_argument("--lng", type=float, default=None, help="longitude of a point to search around")
+    parser.add_argument("--k", type=int, default=5, help="number of nearest stations to list")
+    parser.add_argument("--radius-km", type=float, default=None, help="list every station within this radius")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+    settings = config.config_from_args(args)
+
+    with duckdb.connect(settings['database']) as conn:
+        config.apply_duckdb_settings(conn, settings)
+        build_station_dim(conn)
+        if args.lat is not None and args.lng is not None:
+            index = StationIndex.from_duckdb(conn)
+            if args.radius_km is not None:
+                print(index.within_radius(args.lat, args.lng, args.radius_km))
+            else:
+                print(index.nearest(args.lat, args.lng, args.k))
@@ -0,0 +1,320 @@
+import argparse
+import csv
+import glob
+import io
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+import config
+import data_analyzer
+import duck_data_proc
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# A feed is a file, or a directory of files, that trip events are appended to:
+# JSON Lines with the CSV_COLUMNS keys of duck_data_proc.py, or CSV in the
+# layout of the Divvy CSV (a header line, then one trip per line). Only
+# complete lines are read, so a writer may be half way through a line.
+FEED_PATTERNS = ('*.jsonl', '*.json', '*.csv')
+
+
+class Batch:
+    """Trips read from the feed, and the byte range of each file they came from."""
+
+    def __init__(self):
+        self.rows = []
+        self.offsets = {}  # path -> (start offset, end offset)
+        self.first_read = None
+
+    def add(self, path, start, end, rows):
+        if self.first_read is None:
+            self.first_read = time.monotonic()
+        self.rows += [row + [path] for row in rows]
+        first_start = self.offsets.get(path, (start, end))[0]
+        self.offsets[path] = (first_start, end)
+
+
+def ensure_offsets(conn):
+    """Create the table holding how far into each feed file trips are committed."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stream_offsets (
+            path VARCHAR PRIMARY KEY,
+            byte_offset BIGINT,
+            batches BIGINT,
+            row_count BIGINT,
+            updated_at TIMESTAMP
+        )
+    """)
+
+
+def load_offsets(conn):
+    return dict(conn.execute("SELECT path, byte_offset FROM stream_offsets").fetchall())
+
+
+def list_feed_files(feed):
+    if os.path.isdir(feed):
+        return sorted(os.path.abspath(p) for pattern in FEED_PATTERNS
+                      for p in glob.glob(os.path.join(feed, pattern)))
+    return [os.path.abspath(feed)] if os.path.exists(feed) else []
+
+
+def parse_lines(path, lines, start):
+    """
+    Turn complete feed lines (bytes), read from byte offset `start` of `path`,
+    into rows of strings in CSV_COLUMNS order. A JSON line that is not an event
+    object is logged and skipped, so it cannot hold up the lines after it.
+    """
+    names = list(duck_data_proc.CSV_COLUMNS)
+    if path.endswith('.csv'):
+        if start == 0:
+            lines = lines[1:]  # header
+        text = b''.join(lines).decode('utf-8', errors='replace')
+        rows = csv.reader(io.StringIO(text))
+        return [[value if value != '' else None for value in row[:len(names)]]
+                + [None] * (len(names) - len(row)) for row in rows]
+    rows = []
+    offset = start
+    for line in lines:
+        if line.strip():
+            try:
+                event = json.loads(line)
+                if not isinstance(event, dict):
+                    raise ValueError(f"expected a JSON object, got {type(event).__name__}")
+            except ValueError as e:  # also json.JSONDecodeError and UnicodeDecodeError
+                logging.warning(f"Skipping malformed event at byte {offset} of '{path}': {e}")
+            else:
+                rows.append([None if event.get(name) is None else str(event[name]) for name in names])
+        offset += len(line)
+    return rows
+
+
+def read_feed(feed, offsets, batches, stop, batch_rows=10_000, max_latency=2.0,
+              poll_interval=0.5, read_bytes=1 << 20, once=False):
+    """
+    Tail the feed from `offsets` and put Batch objects on the `batches` queue,
+    each one once it holds batch_rows trips or its oldest trip has waited
+    max_latency seconds. The queue is bounded: when the writer falls behind,
+    put() blocks and reading stops until it catches up. With once set, stop
+    after the feed has been read to its end. A None on the queue marks the end;
+    if reading fails, the exception is put on the queue just before it.
+    """
+    positions = dict(offsets)
+    batch = Batch()
+
+    def flush():
+        nonlocal batch
+        if batch.offsets:
+            while not stop.is_set():
+                try:
+                    batches.put(batch, timeout=poll_interval)
+                    break
+                except queue.Full:
+                    continue  # back-pressure: wait for the writer
+            batch = Batch()
+
+    try:
+        while not stop.is_set():
+            progressed = False
+            for path in list_feed_files(feed):
+                start = positions.get(path, 0)
+                if os.path.getsize(path) <= start:
+                    continue
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    chunk = f.read(read_bytes)
+                # Take whole lines only, and no more than the batch has room for
+                lines = chunk[:chunk.rfind(b'\n') + 1].splitlines(keepends=True)
+                lines = lines[:batch_rows - len(batch.rows) + (start == 0)]
+                if not lines:
+                    continue
+                end = start + sum(len(line) for line in lines)
+                rows = parse_lines(path, lines, start)
+                positions[path] = end
+                batch.add(path, start, end, rows)
+                progressed = True
+                if len(batch.rows) >= batch_rows:
+                    flush()
+            if batch.offsets and (not progressed or time.monotonic() - batch.first_read >= max_latency):
+                flush()
+            if not progressed:
+                if once:
+                    break
+                stop.wait(poll_interval)
+    except Exception as e:
+        logging.exception(f"Reading the feed '{feed}' failed.")
+        batches.put(e)
+    finally:
+        batches.put(None)
+
+
+def apply_batch(conn, batch, cube_source='wide'):
+    """
+    Append a batch to divvy_data, add its trips to divvy_cube and move the
+    feed offsets forward, all in one transaction: after a crash a batch is
+    either fully applied or read again from its start offset. A batch whose
+    start offsets are no longer the committed ones was applied already and is
+    skipped. `cube_source` is the CUBE_SOURCES entry divvy_cube was built
+    from. Returns the number of trips applied.
+    """
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        committed = load_offsets(conn)
+        if any(committed.get(path, 0) != start for path, (start, _) in batch.offsets.items()):
+            conn.execute("ROLLBACK")
+            logging.warning("Skipping a batch that was already applied.")
+            return 0
+
+        columns = list(duck_data_proc.CSV_COLUMNS) + ['source_file']
+        frame = pd.DataFrame(batch.rows, columns=columns, dtype=object)
+        conn.register('stream_events', frame)
+        typed = ', '.join(f"TRY_CAST({name} AS {sql_type}) AS {name}"
+                          for name, sql_type in duck_data_proc.CSV_COLUMNS.items())
+        conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE stream_batch AS
+            SELECT {duck_data_proc.divvy_projection(['source_file'])}
+            FROM (SELECT {typed}, source_file FROM stream_events)
+        """)
+        conn.unregister('stream_events')
+        conn.execute("INSERT INTO divvy_data BY NAME SELECT * FROM stream_batch")
+
+        # The cube only needs this batch's trips, with the derived date parts,
+        # named as the source the cube was built from names them
+        derived = ', '.join(f"{expr}::{sql_type} AS {name}" for name, (sql_type, expr)
+                            in duck_data_proc.DERIVED_COLUMNS.items() if name.startswith('st_'))
+        data_analyzer.merge_into_cube(conn, data_analyzer.CUBE_BATCH_SOURCES[cube_source].format(
+            trips=f"(SELECT *, {derived} FROM stream_batch)"))
+
+        for path, (_, end) in batch.offsets.items():
+            rows = sum(1 for row in batch.rows if row[-1] == path)
+            conn.execute("""
+                INSERT INTO stream_offsets VALUES (?, ?, 1, ?, now())
+                ON CONFLICT (path) DO UPDATE SET byte_offset = excluded.byte_offset,
+                    batches = stream_offsets.batches + 1,
+                    row_count = stream_offsets.row_count + excluded.row_count,
+                    updated_at = excluded.updated_at
+            """, [path, end, rows])
+        conn.execute("DROP TABLE stream_batch")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return len(batch.rows)
+
+
+def refresh_reports(conn, sqlite_conn):
+    """
+    Rebuild every {name}_results table from divvy_cube and export it to the
+    attached SQLite file. The reports only read the cube, so this costs the
+    same however many trips divvy_data holds. Returns the report metrics.
+    """
+    metrics = []
+    cursor = conn.cursor()
+    try:
+        for name, query in data_analyzer.queries.items():
+            metric = data_analyzer.compute_report(conn, name, query)
+            data_analyzer.export_report(cursor, name)
+            metrics.append(metric)
+    finally:
+        cursor.close()
+    data_analyzer.bump_data_version(sqlite_conn)
+    return metrics
+
+
+def run_stream(feed, settings=None, batch_rows=10_000, max_latency=2.0, max_pending=4,
+               poll_interval=0.5, once=False):
+    """
+    Ingest trip events from `feed` in micro-batches until interrupted (or, with
+    once set, until the feed is drained), keeping the exported reports current
+    after every batch. divvy_data and divvy_cube must exist already: run
+    duck_data_proc.py and data_analyzer.py first.
+    """
+    settings = settings or config.load_config()
+    conn = duck_data_proc.connect_to_duckdb(settings)
+    stop = threading.Event()
+    try:
+        if not duck_data_proc.table_exists(conn, 'divvy_data') or not duck_data_proc.table_exists(conn, 'divvy_cube'):
+            raise RuntimeError("Streaming needs the divvy_data table (not the lake view) and divvy_cube; "
+                               "run duck_data_proc.py and data_analyzer.py first.")
+        # New trips must be named as the source divvy_cube was built from names them
+        cube_source = data_analyzer.built_cube_source(conn)
+        if cube_source is None:
+            raise RuntimeError("divvy_cube does not record which source it was built from; "
+                               "rebuild it with data_analyzer.py --force first.")
+        if cube_source != settings['cube_source']:
+            logging.warning(f"divvy_cube was built from the {cube_source} source, not "
+                            f"{settings['cube_source']}; streaming into it as {cube_source}.")
+        ensure_offsets(conn)
+        data_analyzer.attach_sqlite(conn, settings['sqlite_db'])
+        run_id = uuid.uuid4().hex
+
+        with sqlite3.connect(settings['sqlite_db']) as sqlite_conn:
+            data_analyzer.ensure_query_metrics(sqlite_conn)
+            # Catch up in case the last run stopped between a commit and its export
+            refresh_reports(conn, sqlite_conn)
+
+            batches = queue.Queue(maxsize=max_pending)
+            reader = threading.Thread(target=read_feed, name='feed-reader', daemon=True,
+                                      args=(feed, load_offsets(conn), batches, stop),
+                                      kwargs={'batch_rows': batch_rows, 'max_latency': max_latency,
+                                              'poll_interval': poll_interval, 'once': once})
+            reader.start()
+            logging.info(f"Streaming from '{feed}' (batches of up to {batch_rows} trips, "
+                         f"{max_latency}s max latency, {max_pending} batches buffered).")
+
+            total = 0
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise RuntimeError(f"Reading the feed '{feed}' failed after {total} trips "
+                                       f"were applied: {batch}") from batch
+                start = time.perf_counter()
+                applied = apply_batch(conn, batch, cube_source)
+                if not applied:
+                    continue
+                metrics = refresh_reports(conn, sqlite_conn)
+                apply_seconds = time.perf_counter() - start
+                latency = time.monotonic() - batch.first_read
+                total += applied
+                metrics.append(data_analyzer.make_metric('stream', 'batch', apply_seconds, applied))
+                metrics.append(data_analyzer.make_metric('stream', 'latency', latency, applied))
+                source_rows = conn.execute("SELECT COUNT(*) FROM divvy_data").fetchone()[0]
+                data_analyzer.record_metrics(sqlite_conn, run_id, source_rows, metrics)
+                logging.info(f"Applied {applied} trips in {apply_seconds:.2f}s "
+                             f"({latency:.2f}s after they were read, {batches.qsize()} batches waiting).")
+            logging.info(f"Stream finished: {total} trips applied.")
+    except KeyboardInterrupt:
+        logging.info("Stopping; trips read but not committed will be read again on the next run.")
+    finally:
+        stop.set()
+        conn.close()
+
+
+# Main function
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tail a trip event feed into DuckDB and keep the reports current.")
+    parser.add_argument("--feed", default=None,
+                        help="JSONL/CSV file or directory of them to tail (default: stream_feed from the config)")
+    parser.add_argument("--batch-rows", type=int, default=10_000, help="trips per micro-batch at most")
+    parser.add_argument("--max-latency", type=float, default=2.0,
+                        help="seconds a trip may wait before its batch is applied anyway")
+    parser.add_argument("--max-pending", type=int, default=4,
+                        help="batches buffered before reading pauses for the writer to catch up")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="seconds between checks for new events")
+    parser.add_argument("--once", action="store_true", help="stop once the feed has been read to its end")
+    config.add_config_arguments(parser)
+    args = parser.parse_args()
+    settings = config.config_from_args(args)
+
+    run_stream(args.feed or settings['stream_feed'], settings, args.batch_rows, args.max_latency,
+               args.max_pending, args.poll_interval, args.once)